@@ -0,0 +1,315 @@
+# AES file encryption
+#
+# Command-line tool for encrypting and decrypting files with the AES modes
+# from challenges 10 (CBC), 11 (ECB) and 18 (CTR). Input and output files are
+# memory-mapped and processed in chunks through memoryview slices, so large
+# files are never read into memory as a whole. For example:
+#
+#   python aes_cli.py encrypt --mode cbc \
+#       --key 59454c4c4f57205355424d4152494e45 \
+#       --iv 00000000000000000000000000000000 plain.bin cipher.bin --bench
+
+import argparse
+import mmap
+import os
+import sys
+import tempfile
+import time
+import unittest
+import challenge_09
+import challenge_10
+import challenge_11
+import challenge_18
+import xor
+
+modes = ("ecb", "cbc", "ctr")
+
+
+def output_size(mode, encrypt, input_size):
+    """
+    Returns the size to allocate for the output file. For ECB and CBC
+    decryption this is an upper bound, since the amount of padding is only
+    known once the last block has been decrypted.
+    """
+    if mode != "ctr" and encrypt:
+        return (input_size // 16 + 1) * 16
+
+    return input_size
+
+
+def process_file(mode, encrypt, key, src_path, dst_path, iv=None, nonce=b"",
+                 chunk_size=1 << 20, progress=None):
+    """
+    Encrypts or decrypts src_path into dst_path and returns the size of the
+    output. chunk_size is rounded down to a whole number of blocks, and
+    progress(done, total) is called after every chunk if given.
+    """
+    if mode not in modes:
+        raise ValueError("Invalid mode")
+
+    chunk_size = max(chunk_size - chunk_size % 16, 16)
+    total = os.path.getsize(src_path)
+    size = output_size(mode, encrypt, total)
+
+    with open(src_path, "rb") as src, open(dst_path, "w+b") as dst:
+        dst.truncate(size)
+
+        if size == 0:
+            if mode != "ctr":
+                raise ValueError("Invalid length of ciphertext")
+            return 0
+
+        # Empty files can't be mapped
+        src_map = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) \
+            if total else None
+        dst_map = mmap.mmap(dst.fileno(), size)
+
+        try:
+            data = memoryview(src_map) if src_map else memoryview(b"")
+            written = transform(mode, encrypt, key, data, dst_map, iv,
+                                nonce, chunk_size, progress)
+            data.release()
+        finally:
+            dst_map.close()
+            if src_map:
+                src_map.close()
+
+        dst.truncate(written)
+
+    return written
+
+
+def transform(mode, encrypt, key, data, output, iv, nonce, chunk_size,
+              progress):
+    """
+    Runs data through the selected mode chunk by chunk, writing into output
+    (a writable buffer at least output_size() long). Returns the number of
+    bytes written.
+    """
+    total = len(data)
+
+    if mode == "ctr":
+        cipher = challenge_18.AES_CTR(key, nonce)
+
+        for pos in range(0, total, chunk_size):
+            cipher.edit_into(output, pos, data[pos:pos + chunk_size])
+            report_progress(progress, min(pos + chunk_size, total), total)
+
+        return total
+
+    if mode == "cbc":
+        cipher = challenge_10.AES_CBC(key, iv).cipher
+
+        if encrypt:
+            return transform_cbc_encrypt(cipher, data, output, iv,
+                                         chunk_size, progress)
+
+        return transform_cbc_decrypt(cipher, data, output, iv, chunk_size,
+                                     progress)
+
+    # ECB: every chunk but the last is whole blocks without padding, the last
+    # one goes through AES_ECB so padding is added or removed
+    cipher = challenge_11.AES_ECB(key)
+
+    if not encrypt and total % 16 != 0:
+        raise ValueError("Invalid length of ciphertext")
+
+    last = total - (total % 16 if encrypt else 16)
+    last -= last % chunk_size if last > 0 else last
+
+    for pos in range(0, last, chunk_size):
+        chunk = data[pos:pos + chunk_size]
+        if encrypt:
+            output[pos:pos + chunk_size] = cipher.cipher.encrypt_blocks(chunk)
+        else:
+            output[pos:pos + chunk_size] = cipher.cipher.decrypt_blocks(chunk)
+        report_progress(progress, pos + chunk_size, total)
+
+    if encrypt:
+        chunk = cipher.encrypt(data[last:])
+    else:
+        chunk = cipher.decrypt(data[last:])
+
+    output[last:last + len(chunk)] = chunk
+    report_progress(progress, total, total)
+
+    return last + len(chunk)
+
+
+def transform_cbc_encrypt(cipher, data, output, iv, chunk_size, progress):
+    """
+    CBC encryption from one buffer into another. Each block depends on the
+    one before it, so blocks are encrypted one at a time, read from data
+    and written into output in place.
+    """
+    total = len(data)
+    last = total - total % 16
+    previous = bytes(iv)
+
+    for pos in range(0, last, chunk_size):
+        for i in range(pos, min(pos + chunk_size, last), 16):
+            previous = cipher.encrypt(xor.xor(data[i:i + 16], previous))
+            output[i:i + 16] = previous
+
+        report_progress(progress, min(pos + chunk_size, last), total)
+
+    block = challenge_09.pkcs7(bytes(data[last:]), 16)
+    output[last:last + 16] = cipher.encrypt(xor.xor(block, previous))
+    report_progress(progress, total, total)
+
+    return last + 16
+
+
+def transform_cbc_decrypt(cipher, data, output, iv, chunk_size, progress):
+    """
+    CBC decryption from one buffer into another. Every block of a chunk is
+    decrypted in one batch straight into output, then XORed in place with
+    the ciphertext shifted by a block (or the IV, for the first block).
+    Padding is checked on the last block.
+    """
+    total = len(data)
+
+    if total % 16 != 0 or total == 0:
+        raise ValueError("Invalid length of ciphertext")
+
+    for pos in range(0, total, chunk_size):
+        end = min(pos + chunk_size, total)
+        output[pos:end] = cipher.decrypt_blocks(data[pos:end])
+
+        if pos == 0:
+            xor.xor_into(output, iv, 0)
+            xor.xor_into(output, data[:end - 16], 16)
+        else:
+            xor.xor_into(output, data[pos - 16:end - 16], pos)
+
+        report_progress(progress, end, total)
+
+    last = challenge_09.remove_pkcs7(output[total - 16:total], 16)
+
+    return total - 16 + len(last)
+
+
+def report_progress(progress, done, total):
+    if progress is not None:
+        progress(done, total)
+
+
+def print_progress(done, total):
+    percent = 100 * done // total if total else 100
+    sys.stderr.write("\r{}/{} bytes ({}%)".format(done, total, percent))
+
+    if done == total:
+        sys.stderr.write("\n")
+
+    sys.stderr.flush()
+
+
+class AESFileTest(unittest.TestCase):
+    def test_roundtrip(self):
+        key = b"YELLOW SUBMARINE"
+        iv = bytes(range(16))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            plain = os.path.join(tmp, "plain")
+            encrypted = os.path.join(tmp, "encrypted")
+            decrypted = os.path.join(tmp, "decrypted")
+
+            for size in (0, 1, 16, 100, 1000):
+                data = bytes(i % 251 for i in range(size))
+                expected = {
+                    "ecb": challenge_11.AES_ECB(key).encrypt(data),
+                    "cbc": challenge_10.AES_CBC(key, iv).encrypt(data),
+                    "ctr": challenge_18.AES_CTR(key, b"n").encrypt(data),
+                }
+
+                with open(plain, "wb") as f:
+                    f.write(data)
+
+                for mode in modes:
+                    # Small chunks so that blocks span several chunks
+                    for chunk_size in (16, 48, 1 << 20):
+                        process_file(mode, True, key, plain, encrypted, iv,
+                                     b"n", chunk_size)
+                        with open(encrypted, "rb") as f:
+                            self.assertEqual(f.read(), expected[mode])
+
+                        n = process_file(mode, False, key, encrypted,
+                                         decrypted, iv, b"n", chunk_size)
+                        with open(decrypted, "rb") as f:
+                            self.assertEqual(f.read(), data)
+                        self.assertEqual(n, size)
+
+    def test_progress(self):
+        updates = []
+
+        with tempfile.TemporaryDirectory() as tmp:
+            plain = os.path.join(tmp, "plain")
+            with open(plain, "wb") as f:
+                f.write(bytes(100))
+
+            process_file("ecb", True, bytes(16), plain, plain + ".enc",
+                         chunk_size=32, progress=lambda d, t: updates.append(
+                             (d, t)))
+
+        self.assertEqual(updates[-1], (100, 100))
+        self.assertEqual(updates, sorted(updates))
+
+    def test_cbc_buffers(self):
+        key = b"YELLOW SUBMARINE"
+        iv = bytes(range(16))
+        data = bytes(i % 251 for i in range(1000))
+        ciphertext = challenge_10.AES_CBC(key, iv).encrypt(data)
+
+        output = bytearray(output_size("cbc", True, len(data)))
+        n = transform("cbc", True, key, memoryview(data), output, iv, b"",
+                      64, None)
+        self.assertEqual(output[:n], ciphertext)
+
+        output = bytearray(len(ciphertext))
+        n = transform("cbc", False, key, memoryview(ciphertext), output, iv,
+                      b"", 64, None)
+        self.assertEqual(output[:n], data)
+
+        with self.assertRaises(challenge_09.PaddingError):
+            transform("cbc", False, key, memoryview(ciphertext[:-16]),
+                      output, iv, b"", 64, None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Encrypt or decrypt a file with AES.")
+    parser.add_argument("action", choices=("encrypt", "decrypt"))
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--mode", choices=modes, default="cbc")
+    parser.add_argument("--key", required=True, type=bytes.fromhex,
+                        help="key as hex (16, 24 or 32 bytes)")
+    parser.add_argument("--iv", type=bytes.fromhex,
+                        default=bytes(16), help="CBC IV as hex")
+    parser.add_argument("--nonce", type=bytes.fromhex, default=b"",
+                        help="CTR nonce as hex (up to 8 bytes)")
+    parser.add_argument("--chunk-size", type=int, default=1 << 20,
+                        help="bytes processed per chunk (default: 1 MiB)")
+    parser.add_argument("--progress", action="store_true",
+                        help="report progress on stderr")
+    parser.add_argument("--bench", action="store_true",
+                        help="print throughput when done")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    written = process_file(args.mode, args.action == "encrypt", args.key,
+                           args.input, args.output, args.iv, args.nonce,
+                           args.chunk_size,
+                           print_progress if args.progress else None)
+    seconds = time.perf_counter() - start
+
+    if args.bench:
+        size = os.path.getsize(args.input)
+        print("{} bytes in {:.3f} s ({:.3f} MB/s)".format(
+            size, seconds, size / seconds / 1e6))
+
+    return written
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+# AES-GCM
+#
+# Galois/Counter Mode as specified in NIST SP 800-38D, built on the CTR mode
+# from challenge 18. Data is encrypted with a 32-bit big-endian counter
+# following the 96-bit IV, and authenticated with GHASH, a polynomial MAC
+# over GF(2^128) keyed with H = E(K, 0^128).
+#
+# GHASH multiplies by H once per block. Instead of doing this one bit at a
+# time, each key gets a 256-entry table of H multiplied by every byte value
+# (Shoup's method), so a multiplication is 16 table lookups.
+
+import hmac
+import unittest
+import challenge_18
+import xor
+
+# GCM's reduction polynomial x¹²⁸ + x⁷ + x² + x + 1. Bit 0 of a block is the
+# coefficient of x⁰ and the most significant bit of the block read as a
+# big-endian integer, so multiplying by x is a right shift, and an x¹²⁸
+# shifted out is replaced by R.
+R = 0xe1 << 120
+
+
+def gf128_mul(x, y):
+    """
+    Multiplies two elements of GF(2^128) bit by bit (Algorithm 1 of SP
+    800-38D).
+    """
+    z = 0
+
+    for i in range(127, -1, -1):
+        if (x >> i) & 1:
+            z ^= y
+        y = (y >> 1) ^ R if y & 1 else y >> 1
+
+    return z
+
+
+def mul_x(v, n=1):
+    """
+    Multiplies v by x^n.
+    """
+    for _ in range(n):
+        v = (v >> 1) ^ R if v & 1 else v >> 1
+
+    return v
+
+
+def shoup_table(h):
+    """
+    Returns the table of h·b for every byte b in the first (lowest degree)
+    byte of a block, built from the products of h with x⁰ to x⁷.
+    """
+    table = [0] * 256
+    power = h
+
+    for bit in range(7, -1, -1):
+        table[1 << bit] = power
+        power = mul_x(power)
+
+    for b in range(1, 256):
+        low = b & -b
+        table[b] = table[b ^ low] ^ table[low]
+
+    return table
+
+
+# Reduction table for multiplying by x⁸: the low byte of an element that
+# gets shifted out, times x⁸ and reduced
+reduction_table = [mul_x(b, 8) for b in range(256)]
+
+
+class GHASH():
+    """
+    GHASH keyed with a hash subkey h (a 16-byte block). With tables=False
+    every multiplication is done bit by bit with gf128_mul.
+    """
+
+    def __init__(self, h, tables=True):
+        self.h = int.from_bytes(h, 'big')
+        self.table = shoup_table(self.h) if tables else None
+
+    def mul_h(self, y):
+        """
+        Returns y·h. Treating y as a polynomial in x⁸ with byte coefficients,
+        this uses Horner's rule from the highest degree byte down, so each
+        step is a multiplication by x⁸ followed by adding a table entry.
+        """
+        if self.table is None:
+            return gf128_mul(y, self.h)
+
+        table, reduction = self.table, reduction_table
+        z = 0
+
+        for b in y.to_bytes(16, 'little'):
+            z = (z >> 8) ^ reduction[z & 0xff] ^ table[b]
+
+        return z
+
+    def digest(self, data, y=0):
+        """
+        Returns GHASH of data, zero-padded to a multiple of 16 bytes, as an
+        integer. y carries the state over from a previous call.
+        """
+        for i in range(0, len(data), 16):
+            block = bytes(data[i:i + 16]).ljust(16, b"\x00")
+            y = self.mul_h(y ^ int.from_bytes(block, 'big'))
+
+        return y
+
+
+class GCTR(challenge_18.AES_CTR):
+    """
+    CTR mode with GCM's counter blocks. The nonce is the full 16-byte
+    initial counter block, and block i of the keystream encrypts it with
+    i added to the last 32 bits, modulo 2^32.
+    """
+
+    def __init__(self, key, nonce=bytes(16)):
+        super().__init__(key)
+        self.nonce = nonce
+
+    def counter_blocks(self, start, end, nonce=None):
+        if nonce is None:
+            nonce = self.nonce
+
+        if len(nonce) != 16:
+            raise ValueError("Invalid length of counter block")
+
+        if end > 1 << 32:
+            raise ValueError("Counter overflow")
+
+        prefix = bytes(nonce[:12])
+        initial = int.from_bytes(nonce[12:], 'big')
+
+        return b"".join([prefix + ((initial + i) & 0xffffffff).to_bytes(
+            4, 'big') for i in range(start, end)])
+
+
+class AES_GCM():
+    """
+    AES in Galois/Counter Mode. encrypt() returns the ciphertext followed by
+    a 16-byte tag, which decrypt() checks before returning any plaintext.
+    """
+
+    tag_size = 16
+
+    def __init__(self, key, tables=True):
+        self.gctr = GCTR(key)
+        self.ghash = GHASH(self.gctr.cipher.encrypt(bytes(16)), tables)
+
+    def encrypt(self, plaintext, iv, associated_data=b""):
+        j0 = self.initial_counter(iv)
+
+        # Block 0 of the counter masks the tag, data starts at block 1
+        ciphertext = self.gctr.keystream(16, len(plaintext), j0)
+        ciphertext = xor.xor(plaintext, ciphertext)
+
+        return ciphertext + self.tag(j0, ciphertext, associated_data)
+
+    def decrypt(self, ciphertext, iv, associated_data=b""):
+        if len(ciphertext) < self.tag_size:
+            raise ValueError("Invalid length of ciphertext")
+
+        j0 = self.initial_counter(iv)
+        ciphertext, tag = ciphertext[:-self.tag_size], \
+            ciphertext[-self.tag_size:]
+
+        if not hmac.compare_digest(self.tag(j0, ciphertext, associated_data),
+                                   tag):
+            raise ValueError("Invalid tag")
+
+        return xor.xor(ciphertext,
+                       self.gctr.keystream(16, len(ciphertext), j0))
+
+    def initial_counter(self, iv):
+        """
+        Returns the pre-counter block J0. A 96-bit IV is used directly,
+        anything else is hashed.
+        """
+        if len(iv) == 0:
+            raise ValueError("Invalid length of IV")
+
+        if len(iv) == 12:
+            return bytes(iv) + b"\x00\x00\x00\x01"
+
+        lengths = (8 * len(iv)).to_bytes(16, 'big')
+        y = self.ghash.digest(lengths, self.ghash.digest(iv))
+
+        return y.to_bytes(16, 'big')
+
+    def tag(self, j0, ciphertext, associated_data):
+        lengths = (8 * len(associated_data)).to_bytes(8, 'big') + \
+            (8 * len(ciphertext)).to_bytes(8, 'big')
+        y = self.ghash.digest(associated_data)
+        y = self.ghash.digest(ciphertext, y)
+        y = self.ghash.digest(lengths, y)
+
+        return xor.xor(y.to_bytes(16, 'big'), self.gctr.keystream(0, 16, j0))
+
+
+class AESGCMTest(unittest.TestCase):
+    # Test cases 1-4 and 6 from McGrew and Viega, "The Galois/Counter Mode of
+    # Operation (GCM)"
+    key = bytes.fromhex("feffe9928665731c6d6a8f9467308308")
+    plaintext = bytes.fromhex(
+        "d9313225f88406e5a55909c5aff5269a86a7a9531534f7da2e4c303d8a318a72"
+        "1c3c0c95956809532fcf0e2449a6b525b16aedf5aa0de657ba637b391aafd255")
+    associated_data = bytes.fromhex(
+        "feedfacedeadbeeffeedfacedeadbeefabaddad2")
+
+    def test_zero_key(self):
+        for tables in (True, False):
+            cipher = AES_GCM(bytes(16), tables)
+
+            self.assertEqual(cipher.encrypt(b"", bytes(12)).hex(),
+                             "58e2fccefa7e3061367f1d57a4e7455a")
+            self.assertEqual(cipher.encrypt(bytes(16), bytes(12)).hex(),
+                             "0388dace60b6a392f328c2b971b2fe78"
+                             "ab6e47d42cec13bdf53a67b21257bddf")
+
+    def test_encrypt(self):
+        cipher = AES_GCM(self.key)
+        iv = bytes.fromhex("cafebabefacedbaddecaf888")
+
+        self.assertEqual(cipher.encrypt(self.plaintext, iv).hex(),
+                         "42831ec2217774244b7221b784d0d49c"
+                         "e3aa212f2c02a4e035c17e2329aca12e"
+                         "21d514b25466931c7d8f6a5aac84aa05"
+                         "1ba30b396a0aac973d58e091473f5985"
+                         "4d5c2af327cd64a62cf35abd2ba6fab4")
+
+        self.assertEqual(cipher.encrypt(self.plaintext[:60], iv,
+                                        self.associated_data)[-16:].hex(),
+                         "5bc94fbc3221a5db94fae95ae7121a47")
+
+    def test_long_iv(self):
+        cipher = AES_GCM(self.key)
+        iv = bytes.fromhex(
+            "9313225df88406e555909c5aff5269aa6a7a9538534f7da1e4c303d2a318a728"
+            "c3c0c95156809539fcf0e2429a6b525416aedbf5a0de6a57a637b39b")
+
+        self.assertEqual(cipher.encrypt(self.plaintext[:60], iv,
+                                        self.associated_data).hex(),
+                         "8ce24998625615b603a033aca13fb894"
+                         "be9112a5c3a211a8ba262a3cca7e2ca7"
+                         "01e4a9a4fba43c90ccdcb281d48c7c6f"
+                         "d62875d2aca417034c34aee5"
+                         "619cc5aefffe0bfa462af43c1699d050")
+
+    def test_decrypt(self):
+        cipher = AES_GCM(self.key)
+        iv = bytes(12)
+        ciphertext = cipher.encrypt(self.plaintext, iv, b"header")
+
+        self.assertEqual(cipher.decrypt(ciphertext, iv, b"header"),
+                         self.plaintext)
+
+        tampered = bytearray(ciphertext)
+        tampered[0] ^= 1
+
+        for args in ((bytes(tampered), iv, b"header"),
+                     (ciphertext, iv, b"Header"),
+                     (ciphertext, bytes(11) + b"\x01", b"header"),
+                     (ciphertext[:15], iv, b"header")):
+            with self.assertRaises(ValueError):
+                cipher.decrypt(*args)
+
+    def test_ghash_tables(self):
+        h = bytes(range(16))
+        data = bytes(range(100))
+
+        self.assertEqual(GHASH(h).digest(data),
+                         GHASH(h, tables=False).digest(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# Batches
+#
+# Splitting work over a pool of worker processes. Scanning a large input is
+# shared by the challenge 4 and challenge 8 scanners: items are read lazily
+# and numbered, and handed out in batches with only a few batches in flight
+# at a time, so input of any size is scanned in constant memory. Each
+# scanner keeps its best results in a bounded heap.
+#
+# Transforming a buffer block by block is shared by the parallel CBC and
+# CTR modes: the input and output live in shared memory, and each worker
+# writes its own range of the output.
+
+import concurrent.futures
+import heapq
+import itertools
+import os
+import unittest
+from multiprocessing import shared_memory
+
+
+def map_batches(items, function, args=(), merge=None, batch_size=1000,
+                workers=None):
+    """
+    Calls function(batch, *args) on a pool of worker processes, where batch
+    is a list of (item number, item) pairs numbered from 1. merge(size,
+    result) is called in this process as each batch completes, in the order
+    batches complete, with the number of items in the batch.
+    """
+    workers = workers or os.cpu_count() or 1
+    numbered = enumerate(items, 1)
+    batches = iter(lambda: list(itertools.islice(numbered, batch_size)), [])
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        pending = {}
+
+        for batch in itertools.chain(batches, [None]):
+            if batch is not None:
+                future = executor.submit(function, batch, *args)
+                pending[future] = len(batch)
+
+            # Keep the pool busy but don't read ahead further than needed
+            while pending and (len(pending) >= 2 * workers or batch is None):
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for future in done:
+                    size = pending.pop(future)
+
+                    if merge is not None:
+                        merge(size, future.result())
+
+
+def push_top(heap, top, result):
+    """
+    Adds result to a min-heap that keeps the top largest results.
+    """
+    if len(heap) < top:
+        heapq.heappush(heap, result)
+    else:
+        heapq.heappushpop(heap, result)
+
+
+def map_shared(data, function, workers=None, block_size=16):
+    """
+    Transforms data on a pool of worker processes and returns the result,
+    which has the same length. data is split into one contiguous range of
+    whole blocks per worker (the last block may be short), and
+    function(src, dst, start, end) is called in the worker with memoryviews
+    of the shared input and output. It must write dst[start:end] and not
+    keep references to either view.
+    """
+    if len(data) == 0:
+        return b""
+
+    workers = workers or os.cpu_count() or 1
+    n_blocks = -(-len(data) // block_size)
+    per_worker = -(-n_blocks // workers)
+    ranges = [(block_size * i,
+               min(block_size * (i + per_worker), len(data)))
+              for i in range(0, n_blocks, per_worker)]
+
+    src = shared_memory.SharedMemory(create=True, size=len(data))
+    dst = shared_memory.SharedMemory(create=True, size=len(data))
+
+    try:
+        src.buf[:len(data)] = data
+
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(shared_chunk, function, src.name,
+                                       dst.name, start, end)
+                       for start, end in ranges]
+
+            for future in futures:
+                future.result()
+
+        return bytes(dst.buf[:len(data)])
+    finally:
+        for shm in (src, dst):
+            shm.close()
+            shm.unlink()
+
+
+def shared_chunk(function, src_name, dst_name, start, end):
+    """
+    Worker for map_shared(). Attaches to the shared input and output and
+    calls function on them.
+    """
+    src = shared_memory.SharedMemory(src_name)
+    dst = shared_memory.SharedMemory(dst_name)
+
+    try:
+        function(src.buf, dst.buf, start, end)
+    finally:
+        src.close()
+        dst.close()
+
+
+def sum_batch(batch):
+    return sum([number * item for number, item in batch])
+
+
+def invert_chunk(src, dst, start, end):
+    dst[start:end] = bytes([255 - b for b in src[start:end]])
+
+
+class BatchesTest(unittest.TestCase):
+    def test_map_batches(self):
+        results = []
+        map_batches(range(100), sum_batch, batch_size=7, workers=2,
+                    merge=lambda size, result: results.append((size,
+                                                               result)))
+
+        self.assertEqual(sum([size for size, _ in results]), 100)
+        self.assertEqual(sum([result for _, result in results]),
+                         sum([(i + 1) * i for i in range(100)]))
+
+    def test_push_top(self):
+        heap = []
+
+        for n in [5, 1, 9, 3, 7]:
+            push_top(heap, 3, n)
+
+        self.assertEqual(sorted(heap), [5, 7, 9])
+
+    def test_map_shared(self):
+        data = bytes(range(256)) * 3 + b"abc"
+
+        for workers in (1, 3):
+            self.assertEqual(map_shared(data, invert_chunk, workers),
+                             bytes([255 - b for b in data]))
+
+        self.assertEqual(map_shared(b"", invert_chunk), b"")
+
+
+if __name__ == '__main__':
+    unittest.main()
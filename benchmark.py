@@ -0,0 +1,294 @@
+# Benchmarks
+#
+# Throughput measurements for the faster code paths added on top of the
+# challenge solutions. Run with the name of a benchmark, for example:
+#
+#   python benchmark.py aes
+#
+# Numbers are the best of a few runs and are only meant for comparing
+# implementations against each other on the same machine.
+
+import argparse
+import os
+import time
+import aes_gcm
+import challenge_07
+import challenge_10
+import challenge_12
+import challenge_14
+import challenge_18
+import gf256
+import xor
+
+
+def best_time(func, repeat=3):
+    """
+    Returns the fastest wall-clock time in seconds of several calls to func.
+    """
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def report(name, n_bytes, seconds):
+    print("{:<32} {:>10.3f} MB/s".format(name, n_bytes / seconds / 1e6))
+
+
+def report_time(name, seconds):
+    print("{:<32} {:>10.3f} us".format(name, seconds * 1e6))
+
+
+def bench_aes(args):
+    """
+    Compares scalar AES backends with the batched and bitsliced engines.
+    """
+    key = os.urandom(16)
+    data = os.urandom(args.size - args.size % 16)
+    blocks = challenge_07.as_blocks(data, 16)
+
+    for backend in challenge_07.AES.backends:
+        cipher = challenge_07.AES(key, backend=backend)
+        report("{} encrypt (per block)".format(backend), len(data),
+               best_time(lambda: [cipher.encrypt(b) for b in blocks]))
+        report("{} decrypt (per block)".format(backend), len(data),
+               best_time(lambda: [cipher.decrypt(b) for b in blocks]))
+
+    for name, cipher in (("AES", challenge_07.AES(key)),
+                         ("BitslicedAES", challenge_07.BitslicedAES(key))):
+        report("{} encrypt_blocks".format(name), len(data),
+               best_time(lambda: cipher.encrypt_blocks(data)))
+        report("{} decrypt_blocks".format(name), len(data),
+               best_time(lambda: cipher.decrypt_blocks(data)))
+
+
+def mix_block_xtime(state):
+    """
+    MixColumns followed by InvMixColumns on a 4×4 state, calling xtime for
+    every multiplication (the original challenge_07 implementation).
+    """
+    xtime = challenge_07.xtime
+
+    for col in state:
+        tmp = col[0] ^ col[1] ^ col[2] ^ col[3]
+        first = col[0]
+        col[0] ^= xtime(col[0] ^ col[1]) ^ tmp
+        col[1] ^= xtime(col[1] ^ col[2]) ^ tmp
+        col[2] ^= xtime(col[2] ^ col[3]) ^ tmp
+        col[3] ^= xtime(col[3] ^ first) ^ tmp
+
+    for col in state:
+        u = xtime(xtime(col[0] ^ col[2]))
+        v = xtime(xtime(col[1] ^ col[3]))
+        col[0] ^= u
+        col[1] ^= v
+        col[2] ^= u
+        col[3] ^= v
+        tmp = col[0] ^ col[1] ^ col[2] ^ col[3]
+        first = col[0]
+        col[0] ^= xtime(col[0] ^ col[1]) ^ tmp
+        col[1] ^= xtime(col[1] ^ col[2]) ^ tmp
+        col[2] ^= xtime(col[2] ^ col[3]) ^ tmp
+        col[3] ^= xtime(col[3] ^ first) ^ tmp
+
+
+def mix_block_tables(state):
+    """
+    MixColumns followed by InvMixColumns on a 4×4 state using the gf256
+    multiplication tables.
+    """
+    mul2, mul9, mul11, mul13, mul14 = gf256.mul2, gf256.mul9, gf256.mul11, \
+        gf256.mul13, gf256.mul14
+
+    for col in state:
+        tmp = col[0] ^ col[1] ^ col[2] ^ col[3]
+        first = col[0]
+        col[0] ^= mul2[col[0] ^ col[1]] ^ tmp
+        col[1] ^= mul2[col[1] ^ col[2]] ^ tmp
+        col[2] ^= mul2[col[2] ^ col[3]] ^ tmp
+        col[3] ^= mul2[col[3] ^ first] ^ tmp
+
+    for col in state:
+        a0, a1, a2, a3 = col
+        col[0] = mul14[a0] ^ mul11[a1] ^ mul13[a2] ^ mul9[a3]
+        col[1] = mul9[a0] ^ mul14[a1] ^ mul11[a2] ^ mul13[a3]
+        col[2] = mul13[a0] ^ mul9[a1] ^ mul14[a2] ^ mul11[a3]
+        col[3] = mul11[a0] ^ mul13[a1] ^ mul9[a2] ^ mul14[a3]
+
+
+def bench_gf256(args):
+    """
+    Compares the cost per block of column mixing with xtime and with
+    precomputed tables, and the resulting cost of a full AES block.
+    """
+    n = max(args.size // 16, 1)
+    states = [challenge_07.as_blocks(list(b), 4) for b in
+              challenge_07.as_blocks(os.urandom(16 * n), 16)]
+
+    for name, func in (("mix columns (xtime)", mix_block_xtime),
+                       ("mix columns (tables)", mix_block_tables)):
+        seconds = best_time(lambda: [func(state) for state in states])
+        report_time("{} per block".format(name), seconds / n)
+
+    cipher = challenge_07.AES(os.urandom(16))
+    blocks = challenge_07.as_blocks(os.urandom(16 * n), 16)
+    report_time("AES encrypt per block", best_time(
+        lambda: [cipher.encrypt(b) for b in blocks]) / n)
+    report_time("AES decrypt per block", best_time(
+        lambda: [cipher.decrypt(b) for b in blocks]) / n)
+
+
+def bench_cbc(args):
+    """
+    Compares serial CBC decryption with decrypt_parallel() for 1 to
+    --workers processes.
+    """
+    cipher = challenge_10.AES_CBC(os.urandom(16), os.urandom(16))
+    ciphertext = cipher.encrypt(os.urandom(args.size))
+
+    report("serial decrypt", len(ciphertext),
+           best_time(lambda: cipher.decrypt(ciphertext)))
+
+    for workers in range(1, args.workers + 1):
+        report("parallel decrypt ({} workers)".format(workers),
+               len(ciphertext), best_time(
+                   lambda: cipher.decrypt_parallel(ciphertext, workers)))
+
+
+def bench_ctr(args):
+    """
+    Compares serial CTR encryption with encrypt_parallel() for 1 to
+    --workers processes.
+    """
+    cipher = challenge_18.AES_CTR(os.urandom(16), os.urandom(8))
+    plaintext = os.urandom(args.size)
+
+    report("serial encrypt", len(plaintext),
+           best_time(lambda: cipher.encrypt(plaintext)))
+
+    for workers in range(1, args.workers + 1):
+        report("parallel encrypt ({} workers)".format(workers),
+               len(plaintext), best_time(
+                   lambda: cipher.encrypt_parallel(plaintext, None, workers)))
+
+
+def bench_ghash(args):
+    """
+    Compares GHASH with bit-by-bit multiplication and with per-key Shoup
+    tables, and reports AES-GCM encryption throughput.
+    """
+    h = os.urandom(16)
+    data = os.urandom(args.size)
+
+    for name, tables in (("bit by bit", False), ("tables", True)):
+        ghash = aes_gcm.GHASH(h, tables)
+        report("GHASH ({})".format(name), len(data),
+               best_time(lambda: ghash.digest(data)))
+
+    report_time("GHASH table setup", best_time(
+        lambda: aes_gcm.GHASH(h), 10))
+
+    cipher = aes_gcm.AES_GCM(os.urandom(16))
+    iv = os.urandom(12)
+    report("AES-GCM encrypt", len(data),
+           best_time(lambda: cipher.encrypt(data, iv)))
+
+
+def bench_ecb_oracle(args):
+    """
+    Compares byte-at-a-time ECB decryption (challenges 12 and 14) asking the
+    oracle about one guess at a time and with a codebook of all 256 guesses
+    per query, and reports the number of queries made. Then compares the
+    codebook attack with the thread pool driver against an oracle that
+    takes 10 ms to answer.
+    """
+    def run(name, attack, encryption_oracle):
+        oracle = challenge_12.CountingOracle(encryption_oracle)
+        start = time.perf_counter()
+        plaintext = attack(oracle)
+        seconds = time.perf_counter() - start
+
+        print("{:<32} {:>10.3f} s  {:>6} queries ({:.1f} per byte)".format(
+            name, seconds, oracle.queries, oracle.queries / len(plaintext)))
+
+    for challenge in (challenge_12, challenge_14):
+        for name, attack in (("one guess", challenge.recover_plaintext),
+                             ("batched", challenge.recover_plaintext_batched)):
+            run("{} ({})".format(challenge.__name__, name), attack,
+                challenge.encryption_oracle)
+
+    def slow_oracle(plaintext):
+        time.sleep(0.01)
+        return challenge_12.encryption_oracle(plaintext)
+
+    run("slow oracle (batched)", challenge_12.recover_plaintext_batched,
+        slow_oracle)
+
+    for workers in (2, 4, 8):
+        run("slow oracle ({} threads)".format(workers),
+            lambda oracle: challenge_12.recover_plaintext_parallel(
+                oracle, workers), slow_oracle)
+
+
+def xor_bytewise(a, b):
+    """
+    Byte-by-byte XOR, as challenge_02.fixed_xor was originally written.
+    """
+    return bytes([a[i] ^ b[i] for i in range(len(a))])
+
+
+def bench_xor(args):
+    """
+    Compares byte-by-byte XOR with the integer and NumPy paths of xor.xor()
+    for inputs from 16 B to 100 MB. --size is not used. The byte-by-byte
+    version is skipped above 1 MiB as it takes too long.
+    """
+    min_vector_size = xor.min_vector_size
+
+    for n in (16, 256, 1 << 12, 1 << 16, 1 << 20, 1 << 24, 100000000):
+        a, b = os.urandom(n), os.urandom(n)
+        repeat = 3 if n >= 1 << 20 else max(3, (1 << 20) // n)
+
+        def run(func):
+            return best_time(lambda: func(a, b), repeat)
+
+        if n <= 1 << 20:
+            report("bytewise ({} B)".format(n), n, run(xor_bytewise))
+
+        try:
+            xor.min_vector_size = n + 1
+            report("int.from_bytes ({} B)".format(n), n, run(xor.xor))
+
+            if xor.numpy is not None:
+                xor.min_vector_size = 0
+                report("numpy ({} B)".format(n), n, run(xor.xor))
+        finally:
+            xor.min_vector_size = min_vector_size
+
+
+benchmarks = {
+    "aes": bench_aes,
+    "cbc": bench_cbc,
+    "ctr": bench_ctr,
+    "ecb-oracle": bench_ecb_oracle,
+    "gf256": bench_gf256,
+    "ghash": bench_ghash,
+    "xor": bench_xor,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run benchmarks.")
+    parser.add_argument("name", choices=sorted(benchmarks))
+    parser.add_argument("--size", type=int, default=1 << 20,
+                        help="input size in bytes (default: 1 MiB)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="maximum number of worker processes (default: "
+                        "number of CPUs)")
+    args = parser.parse_args()
+
+    benchmarks[args.name](args)
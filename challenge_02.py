@@ -3,6 +3,7 @@
 # https://cryptopals.com/sets/1/challenges/2
 
 import unittest
+import xor
 
 
 class Challenge2(unittest.TestCase):
@@ -15,8 +16,7 @@ class Challenge2(unittest.TestCase):
 
 
 def fixed_xor(bytes1, bytes2):
-    assert(len(bytes1) == len(bytes2))
-    return bytes([bytes1[i] ^ bytes2[i] for i in range(len(bytes1))])
+    return xor.xor(bytes1, bytes2)
 
 
 if __name__ == '__main__':
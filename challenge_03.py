@@ -2,7 +2,9 @@
 #
 # https://cryptopals.com/sets/1/challenges/3
 
-import challenge_02
+import language
+import unittest
+import xor
 
 letter_scores = {
     "e": 26, "t": 25, "a": 24, "o": 23, "i": 22, "n": 21, "s": 20, "h": 19,
@@ -11,33 +13,79 @@ letter_scores = {
     "q": 2,  "z": 1,  " ": 20
 }
 
+# letter_scores as a language model, with a score for every byte value. The
+# default model used below is language.english instead.
+letter_model = language.UnigramModel([letter_scores.get(chr(b), -5)
+                                      for b in bytes(range(256)).lower()])
 
-def frequency_score(plaintext):
+
+class Challenge3(unittest.TestCase):
+    ciphertext = bytes.fromhex(
+        "1b37373331363f78151b7f2b783431333d78397828372d363c78373e783a393b3736")
+
+    def test_guess_with_frequency(self):
+        key, plaintext, score = guess_with_frequency(self.ciphertext)
+
+        self.assertEqual(key, b"X")
+        self.assertEqual(plaintext, b"Cooking MC's like a pound of bacon")
+        self.assertAlmostEqual(score, frequency_score(plaintext))
+
+        for model in (letter_model, language.english_chi_squared):
+            self.assertEqual(guess_with_frequency(self.ciphertext, model)[:2],
+                             (key, plaintext))
+
+    def test_rank_keys(self):
+        ciphertext = self.ciphertext + bytes(range(256))
+        expected = sorted(
+            ((k, frequency_score(bytes(c ^ k for c in ciphertext),
+                                 letter_model)) for k in range(256)),
+            key=lambda x: -x[1])
+
+        self.assertEqual(rank_keys(ciphertext, letter_model), expected)
+        self.assertEqual(rank_keys(ciphertext, letter_model, False), expected)
+
+    def test_all_keys(self):
+        # 0xff is a candidate too
+        plaintext = b"the quick brown fox jumps over the lazy dog"
+        ciphertext = bytes(c ^ 0xff for c in plaintext)
+
+        self.assertEqual(guess_with_frequency(ciphertext)[:2],
+                         (b"\xff", plaintext))
+        self.assertEqual(guess_with_frequency(b""), (b"", b"", 1.0))
+        self.assertEqual(guess_with_frequency(bytes(range(256))),
+                         (b"", b"", 1.0))
+
+
+def frequency_score(plaintext, model=language.english):
     """
     Returns a score representing how closely letter frequencies match the
     expected values found in the English language.
     """
-    return sum([letter_scores.get(chr(b), -5) for b in plaintext.lower()])
+    return model.score(plaintext)
 
 
-def guess_with_frequency(ciphertext):
-    key = b""
-    plaintext = b""
-    max_score = 1.0
+def rank_keys(ciphertext, model=language.english, vectorize=True):
+    """
+    Scores every single-byte key and returns (key, score) pairs, best first.
+    The ciphertext is only counted once, see language.UnigramModel.
+    """
+    return model.rank_keys(ciphertext, vectorize)
+
+
+def guess_with_frequency(ciphertext, model=language.english):
+    """
+    Returns the best scoring single-byte key, the plaintext it gives and its
+    score, or an empty key and plaintext if no key scores above the model's
+    threshold.
+    """
+    key, score = rank_keys(ciphertext, model)[0]
 
-    for i in range(255):
-        # Guess a repeating key and record the frequency score
-        guessed_key = bytes.fromhex('{0:02x}'.format(i))
-        guessed_plaintext = challenge_02.fixed_xor(guessed_key *
-                                                   len(ciphertext), ciphertext)
-        score = frequency_score(guessed_plaintext)
+    if score <= model.threshold:
+        return b"", b"", model.threshold
 
-        if score > max_score:
-            max_score = score
-            key = guessed_key
-            plaintext = guessed_plaintext
+    key = bytes([key])
 
-    return key, plaintext, max_score
+    return key, xor.xor_repeating(key, ciphertext), score
 
 
 if __name__ == '__main__':
@@ -2,22 +2,144 @@
 #
 # https://cryptopals.com/sets/1/challenges/4
 
+import argparse
+import functools
+import heapq
+import io
+import sys
+import time
+import unittest
+import batches
 import challenge_03
+import language
+
+
+class Challenge4(unittest.TestCase):
+    def test_scan_lines(self):
+        with open("04.txt", "r") as f:
+            results = scan_lines(f, top=3, batch_size=50, workers=2)
+
+        # Only one line scores above the threshold
+        self.assertEqual([r[1:] for r in results],
+                         [(171, b"5", b"Now that the party is jumping\n")])
+
+    def test_top(self):
+        plaintexts = [b"hello world", b"the cat sat on the mat",
+                      b"hello world"]
+        lines = [bytes(c ^ 7 for c in p).hex() for p in plaintexts] * 10
+        results = scan_lines(lines, top=4, batch_size=3, workers=2)
+
+        # Ties go to the earliest line
+        self.assertEqual([r[1] for r in results], [2, 5, 8, 11])
+        self.assertEqual(results, sorted(results, key=lambda r: (-r[0], r[1])))
+
+    def test_invalid_lines(self):
+        lines = io.StringIO("zz\n\n" + bytes(c ^ 1 for c in
+                                             b"hello world").hex() + "\n")
+        results = scan_lines(lines, workers=1)
+
+        self.assertEqual([r[1:] for r in results], [(3, b"\x01",
+                                                     b"hello world")])
+
+
+@functools.lru_cache()
+def load_model(path):
+    """
+    Loads a model file once per process, or returns the default model if
+    path is None.
+    """
+    return language.load(path) if path else language.english
+
+
+def scan_batch(batch, top, model_path=None):
+    """
+    Worker for scan_lines(). Breaks each (line number, hex) pair in batch and
+    returns the top results as (score, -line number, key, plaintext), so that
+    ties go to the earliest line. Lines that aren't valid hex or don't look
+    like English are skipped.
+    """
+    model = load_model(model_path)
+    results = []
+
+    for line_number, line in batch:
+        try:
+            ciphertext = bytes.fromhex(line)
+        except ValueError:
+            continue
+
+        key, plaintext, score = challenge_03.guess_with_frequency(ciphertext,
+                                                                  model)
+        if key:
+            results.append((score, -line_number, key, plaintext))
+
+    return heapq.nlargest(top, results)
+
+
+def scan_lines(lines, top=10, batch_size=1000, workers=None, model_path=None,
+               report=None):
+    """
+    Finds the top lines of hex that decrypt to English under a single-byte
+    key. Lines are read lazily and handed to a pool of worker processes in
+    batches, with only a few batches in flight at a time so that input of
+    any size is scanned in constant memory. Returns the results as (score,
+    line number, key, plaintext), best first.
+
+    report(lines, seconds) is called as batches complete, with the number of
+    lines scanned so far.
+    """
+    heap = []
+    scanned = 0
+    start = time.perf_counter()
+
+    def merge(size, results):
+        nonlocal scanned
+        scanned += size
+
+        for result in results:
+            batches.push_top(heap, top, result)
+
+        if report is not None:
+            report(scanned, time.perf_counter() - start)
+
+    batches.map_batches((line.strip() for line in lines), scan_batch,
+                        (top, model_path), merge, batch_size, workers)
+
+    return [(score, -line_number, key, plaintext) for score, line_number,
+            key, plaintext in sorted(heap, reverse=True)]
+
 
 if __name__ == '__main__':
-    max_score = 1.0
-    key = b""
-    plaintext = b""
-
-    for line in open("04.txt", "r"):
-        guessed_key, guessed_plaintext, score = \
-            challenge_03.guess_with_frequency(bytes.fromhex(line))
-
-        if score > max_score:
-            max_score = score
-            key = guessed_key
-            plaintext = guessed_plaintext
-
-    print("Key      : {}".format(key))
-    print("Plaintext: {}".format(plaintext.decode()))
-    print("Score    : {}".format(max_score))
+    parser = argparse.ArgumentParser(
+        description="Find lines of hex encrypted with single-byte XOR.")
+    parser.add_argument("input", nargs="?", default="04.txt",
+                        help="file of hex lines, or - for stdin "
+                        "(default: 04.txt)")
+    parser.add_argument("--top", type=int, default=1,
+                        help="number of results to keep (default: 1)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number "
+                        "of CPUs)")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="lines per batch (default: 1000)")
+    parser.add_argument("--model",
+                        help="model file written by language.py")
+    args = parser.parse_args()
+
+    def report(lines, seconds):
+        sys.stderr.write("\r{} lines in {:.2f} s ({:.0f} lines/s)".format(
+            lines, seconds, lines / seconds if seconds else 0))
+        sys.stderr.flush()
+
+    src = sys.stdin if args.input == "-" else open(args.input, "r")
+
+    with src:
+        results = scan_lines(src, args.top, args.batch_size, args.workers,
+                             args.model, report)
+
+    sys.stderr.write("\n")
+
+    for score, line_number, key, plaintext in results:
+        print("Line     : {}".format(line_number))
+        print("Key      : {}".format(key))
+        print("Plaintext: {}".format(plaintext.decode(errors="replace")))
+        print("Score    : {}".format(score))
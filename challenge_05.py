@@ -2,7 +2,9 @@
 #
 # https://cryptopals.com/sets/1/challenges/5
 
+import io
 import unittest
+import xor
 
 
 class Challenge5(unittest.TestCase):
@@ -17,19 +19,77 @@ class Challenge5(unittest.TestCase):
                          + "652a3124333a653e2b2027630c692b202831652863263"
                          + "02e27282f")
 
+    def test_repeating_xor_stream(self):
+        key = b"ICE"
+        plaintext = bytes(range(256)) * 10
+        expected = repeating_xor(key, plaintext)
+
+        for chunk_size in (1, 5, 64, 1 << 16):
+            chunks = [plaintext[i:i + chunk_size]
+                      for i in range(0, len(plaintext), chunk_size)]
+            output = repeating_xor_stream(key, chunks, chunk_size=chunk_size)
+            self.assertEqual(b"".join(output), expected)
+
+            output = repeating_xor_stream(key, io.BytesIO(plaintext),
+                                          chunk_size=chunk_size)
+            self.assertEqual(b"".join(output), expected)
 
-def rotate(items):
-    return items[1:] + items[:1]
+        # Chunks longer than chunk_size, starting part way into the stream
+        output = repeating_xor_stream(key, [plaintext[100:1000],
+                                            plaintext[1000:]], 100, 16)
+        self.assertEqual(b"".join(output), expected[100:])
+
+        # Errors are raised by the call, not on the first chunk
+        with self.assertRaises(ValueError):
+            repeating_xor_stream(b"", io.BytesIO(plaintext))
+
+        # Empty chunks, including the first
+        output = repeating_xor_stream(key, [b"", plaintext[:10], b"",
+                                            plaintext[10:]])
+        self.assertEqual(b"".join(output), expected)
 
 
 def repeating_xor(key, plaintext):
-    output = bytearray()
+    return xor.xor_repeating(key, plaintext)
+
+
+def repeating_xor_stream(key, src, offset=0, chunk_size=1 << 16):
+    """
+    Lazily applies repeating-key XOR to src, which is either a file object
+    or an iterable of bytes-like chunks, yielding one output chunk for each
+    input chunk so that only a chunk is held in memory at a time. offset is
+    the position of the first byte of src in the stream, which lets a file be
+    processed starting from any point.
+    """
+    if not key:
+        raise ValueError("Key must not be empty")
+
+    if hasattr(src, "read"):
+        read = src.read
+        src = iter(lambda: read(chunk_size), b"")
+
+    return xor_chunks(key, src, offset, chunk_size)
+
+
+def xor_chunks(key, src, offset, chunk_size):
+    """
+    Generator behind repeating_xor_stream(), for an iterable of chunks.
+    """
+    # Key repeated to cover a chunk from any phase, built once. It only
+    # needs to grow if a chunk is longer than chunk_size.
+    tiled = b""
+    keystream = memoryview(tiled)
+
+    for chunk in src:
+        phase = offset % len(key)
 
-    for i in range(len(plaintext)):
-        output.append(plaintext[i] ^ key[0])
-        key = rotate(key)
+        if phase + len(chunk) > len(tiled):
+            repeats = (phase + max(len(chunk), chunk_size)) // len(key) + 1
+            tiled = bytes(key) * repeats
+            keystream = memoryview(tiled)
 
-    return bytes(output)
+        yield xor.xor(chunk, keystream[phase:phase + len(chunk)])
+        offset += len(chunk)
 
 
 if __name__ == '__main__':
@@ -3,16 +3,122 @@
 # https://cryptopals.com/sets/1/challenges/6
 
 import base64
+import random
+import statistics
 import challenge_03
 import challenge_05
+import language
+import sys
 import unittest
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of set bits in every byte value
+popcounts = bytes(bin(b).count("1") for b in range(256))
+if numpy is not None:
+    popcounts = numpy.frombuffer(popcounts, numpy.uint8)
+
 
 class Challenge06(unittest.TestCase):
     def test_hamming_distance(self):
         self.assertEqual(hamming_distance(b"this is a test",
                          b"wokka wokka!!!"), 37)
 
+        # Leading zero bytes count too
+        self.assertEqual(hamming_distance(b"\x00\x01", b"\xff\x01"), 8)
+        self.assertEqual(hamming_distance(b"", b""), 0)
+
+        with self.assertRaises(ValueError):
+            hamming_distance(b"a", b"ab")
+
+    def test_block_distances(self):
+        blocks1 = [b"this is a test", b"\x00" * 14]
+        blocks2 = [b"wokka wokka!!!", b"\xff" * 14]
+
+        self.assertEqual(block_distances(blocks1, blocks2), [37, 112])
+
+        if numpy is not None:
+            arrays = [numpy.frombuffer(b"".join(blocks), numpy.uint8)
+                      .reshape(2, 14) for blocks in (blocks1, blocks2)]
+            self.assertEqual(block_distances(*arrays), [37, 112])
+
+    def test_keysize_distances(self):
+        data = bytes((i * i * 7 + i // 5) % 251 for i in range(1000))
+        expected = [None] + [hamming_distance(data[:-k], data[k:])
+                             for k in range(1, 600)]
+
+        self.assertEqual(keysize_distances(data, 599, vectorize=False),
+                         expected)
+        self.assertEqual(keysize_distances(data, 599), expected)
+
+    def test_guess_keysize(self):
+        ciphertext = base64.b64decode(open("06.txt", "r").read())
+        ranked = rank_keysizes(ciphertext, 1000, top=5)
+
+        # Multiples of the key size score as well as the key size itself
+        self.assertEqual(len(ranked), 5)
+        self.assertTrue(all(size % 29 == 0 for size, _ in ranked))
+        self.assertEqual(guess_keysize(ciphertext, 40), 29)
+        self.assertEqual(guess_keysize(ciphertext, 1000), 29)
+
+        # Short keys, where most candidates are multiples of the key size
+        plaintext = challenge_05.repeating_xor(
+            b"Terminator X: Bring the noise", ciphertext)
+
+        for key in (b"\x22\x91", b"ICE", b"YELLOW SUBMARINE"):
+            ciphertext = challenge_05.repeating_xor(key, plaintext)
+            self.assertEqual(guess_keysize(ciphertext, 40), len(key))
+
+    def test_best_keysize(self):
+        rng = random.Random(6)
+
+        # Aligned sizes score about 2.8, others about 3.2, with noise, one
+        # misaligned size among the aligned ones, and one aligned size among
+        # the misaligned ones. Key sizes up to 8 have enough multiples up
+        # to 40 that one outlier can't outvote the rest.
+        for key_size in range(2, 9):
+            for _ in range(10):
+                scores = {k: rng.gauss(3.2 if k % key_size else 2.8, 0.03)
+                          for k in range(2, 41)}
+                scores[rng.randrange(key_size, 41, key_size)] = 3.2
+                scores[rng.choice([k for k in scores if k % key_size])] = \
+                    2.85
+                scores = list(scores.items())
+
+                best = min(scores, key=lambda x: x[1])[0]
+                self.assertEqual(best_keysize(scores),
+                                 key_size if best % key_size == 0 else best)
+
+    def test_helpers(self):
+        data = b"this is a testwokka wokka!!!"
+
+        self.assertEqual(avg_hamming_distance(data, 14), 37 / 14)
+        self.assertEqual(to_blocks(data, 14), [data[:14], data[14:]])
+        self.assertEqual(transpose_blocks(bytes(range(5)), 2),
+                         [[0, 2, 4], [1, 3]])
+        self.assertEqual(bytes_to_bits(b"\x05"), "0b101")
+
+        with self.assertRaises(ValueError):
+            avg_hamming_distance(data, 20)
+
+    def test_column_views(self):
+        data = bytes(range(10))
+        columns = column_views(data, 4)
+
+        self.assertEqual([bytes(c) for c in columns],
+                         [b"\x00\x04\x08", b"\x01\x05\x09", b"\x02\x06",
+                          b"\x03\x07"])
+        self.assertTrue(all(c.obj is data for c in columns))
+
+    def test_break_repeating_xor(self):
+        ciphertext = base64.b64decode(open("06.txt", "r").read())
+
+        self.assertEqual(break_repeating_xor(ciphertext),
+                         b"Terminator X: Bring the noise")
+
 
 def bytes_to_bits(bytes1):
     return bin(int.from_bytes(bytes1, 'big'))
@@ -24,21 +130,27 @@ def to_blocks(list1, size):
 
 def hamming_distance(bytes1, bytes2):
     """
-    Calculates the hamming distance in bits.
+    Calculates the hamming distance in bits between two byte strings of the
+    same length, by counting the set bits of their XOR.
     """
-    bits1 = bytes_to_bits(bytes1)
-    bits2 = bytes_to_bits(bytes2)
-    length = min(len(bits1), len(bits2))
+    if len(bytes1) != len(bytes2):
+        raise ValueError("Inputs must be of equal length")
+
+    return (int.from_bytes(bytes1, 'big') ^
+            int.from_bytes(bytes2, 'big')).bit_count()
 
-    # Calculate deletions
-    distance = max(len(bits1), len(bits2)) - length
 
-    # Calculate swaps
-    for i in range(length):
-        if bits1[i] != bits2[i]:
-            distance += 1
+def block_distances(blocks1, blocks2):
+    """
+    Returns the hamming distances between corresponding blocks of two lists
+    of blocks. Two 2D NumPy arrays of uint8 (one block per row) are handled
+    in one go with a popcount table.
+    """
+    if numpy is not None and isinstance(blocks1, numpy.ndarray):
+        xored = numpy.bitwise_xor(blocks1, blocks2)
+        return popcounts[xored].sum(axis=-1, dtype=numpy.int64).tolist()
 
-    return distance
+    return [hamming_distance(a, b) for a, b in zip(blocks1, blocks2)]
 
 
 def avg_hamming_distance(bytes1, block_size):
@@ -46,53 +158,189 @@ def avg_hamming_distance(bytes1, block_size):
     Calculates the average hamming distance in bits that occurs over blocks of
     a given size.
     """
-    distances = []
-    prev_block = None
+    pairs = len(bytes1) // block_size - 1
+
+    if pairs < 1:
+        raise ValueError("Need at least two blocks")
+
+    # All pairs of neighbouring blocks at once
+    length = pairs * block_size
+    distance = hamming_distance(bytes1[:length],
+                                bytes1[block_size:block_size + length])
+
+    return distance / length
+
+
+def fft_size(n):
+    """
+    Returns the smallest number of the form 2^a·3^b·5^c that is at least n,
+    for which NumPy's FFT is fast.
+    """
+    best = 1 << (n - 1).bit_length()
+    power5 = 1
+
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            size = power35
+            while size < n:
+                size *= 2
+            best = min(best, size)
+            power35 *= 3
+        power5 *= 5
+
+    return best
+
+
+def keysize_distances(bytes1, max_size, vectorize=True):
+    """
+    Returns a list whose entry k is the hamming distance between bytes1 and
+    itself shifted by k bytes, i.e. between every block of size k and the
+    following k bytes, for k from 1 to max_size (entry 0 is None).
 
-    for block in to_blocks(bytes1, block_size):
-        if prev_block is not None and len(block) == len(prev_block):
-            distance = hamming_distance(block, prev_block)
-            distances.append(distance / len(block))
-        prev_block = block
+    Without NumPy each shift is one XOR of the whole input as an integer.
+    With NumPy every shift is computed at once: writing each bit plane as ±1
+    values s, the distance at shift k is (8·(n - k) - Σ s[j]·s[j + k]) / 2,
+    and the sums for all k are the autocorrelation of the planes, which an
+    FFT gives in O(n log n).
+    """
+    n = len(bytes1)
+    max_size = min(max_size, n - 1)
+    distances = [None]
+
+    if numpy is not None and vectorize and max_size > 0:
+        data = numpy.frombuffer(bytes1, numpy.uint8)
+        size = fft_size(n + max_size)
+        power = 0
+
+        for bit in range(8):
+            signs = 1.0 - 2.0 * ((data >> bit) & 1)
+            transform = numpy.fft.rfft(signs, size)
+            power = power + transform.real ** 2 + transform.imag ** 2
+
+        correlation = numpy.fft.irfft(power, size)[1:max_size + 1]
+        shifts = numpy.arange(1, max_size + 1)
+        distances += numpy.rint((8 * (n - shifts) - correlation) / 2) \
+            .astype(numpy.int64).tolist()
+
+        return distances
 
-    return sum(distances) / len(distances)
+    number = int.from_bytes(bytes1, 'big')
+
+    for k in range(1, max_size + 1):
+        # The first n - k bytes are the high bits, the last n - k the low
+        mask = (1 << (8 * (n - k))) - 1
+        distances.append(((number >> (8 * k)) ^ (number & mask)).bit_count())
+
+    return distances
+
+
+def keysize_scores(bytes1, max_size):
+    """
+    Returns (keysize, score) for every keysize from 2 to max_size that fits
+    at least twice in bytes1, where the score is the average hamming
+    distance in bits per byte between bytes that are keysize apart.
+    """
+    max_size = min(max_size, len(bytes1) // 2)
+    distances = keysize_distances(bytes1, max_size)
+
+    return [(k, distances[k] / (len(bytes1) - k))
+            for k in range(2, max_size + 1)]
+
+
+def rank_keysizes(bytes1, max_size, top=5):
+    """
+    Returns the top keysizes as (keysize, score), lowest average hamming
+    distance first.
+    """
+    return sorted(keysize_scores(bytes1, max_size),
+                  key=lambda x: x[1])[:top]
 
 
 def guess_keysize(bytes1, max_size):
     """
     Calculates the most likely key size based on average hamming distance.
     """
-    avgs = [avg_hamming_distance(bytes1, size) for size in
-            range(2, max_size + 1)]
+    scores = keysize_scores(bytes1, max_size)
 
-    # Add 2 to index since that was our starting keysize
-    return avgs.index(min(avgs)) + 2
+    if not scores:
+        raise ValueError("Input too short")
 
+    return best_keysize(scores)
 
-def transpose_blocks(bytes1, size):
+
+def best_keysize(scores):
+    """
+    Picks the key size from a list of (keysize, score), lowest score best.
+
+    Every multiple of the key size lines the key up as well, so the
+    top-ranked size is often a multiple of the key size. Each divisor d of
+    the top-ranked size k is tried, smallest first: if d is the key size,
+    the multiples of d that aren't multiples of k score like the multiples
+    of k, otherwise like the sizes that aren't multiples of d. d is taken
+    if their median is within a third of the way from the first group's
+    median to the second's, since a key whose bytes d apart happen to be
+    similar lands in between. Comparing the medians of groups rather than
+    single scores means one noisy score can't decide, but a misaligned size
+    that scores better than all the aligned ones is still returned, as by
+    rank_keysizes().
+    """
+    median = statistics.median
+    k = min(scores, key=lambda x: x[1])[0]
+    aligned = median([score for size, score in scores if size % k == 0])
+
+    for d in range(2, k):
+        extra = [score for size, score in scores
+                 if size % d == 0 and size % k != 0]
+        misaligned = [score for size, score in scores if size % d != 0]
+
+        if k % d != 0 or not extra or not misaligned:
+            continue
+
+        if median(extra) < aligned + (median(misaligned) - aligned) / 3:
+            return d
+
+    return k
+
+
+def column_views(bytes1, size):
     """
-    Returns a transposed version of given bytes.
+    Returns one view per position in a block of the given size, holding the
+    bytes at that position in every block (so column i is bytes1[i::size]).
+    The views are strided memoryview slices of bytes1, so nothing is copied.
+    A shorter last block just means the later columns are one byte shorter.
     """
-    blocks = []
+    view = memoryview(bytes1)
+    return [view[i::size] for i in range(size)]
 
-    for i in range(size):
-        new_block = []
-        for block in to_blocks(bytes1, size):
-            if i < len(block):
-                new_block.append(block[i])
-        blocks.append(new_block)
 
-    return blocks
+def transpose_blocks(bytes1, size):
+    """
+    Returns a transposed version of given bytes, as lists of byte values.
+    """
+    return [list(column) for column in column_views(bytes1, size)]
 
 
-if __name__ == '__main__':
-    ciphertext = base64.b64decode(open("06.txt", "r").read())
-    keysize = guess_keysize(ciphertext, 40)
+def break_repeating_xor(ciphertext, max_keysize=40, model=language.english):
+    """
+    Guesses the key size, then each key byte by breaking the column of
+    ciphertext bytes it was XORed with as single-byte XOR.
+    """
+    keysize = guess_keysize(ciphertext, max_keysize)
     key = bytearray()
 
-    for block in transpose_blocks(ciphertext, keysize):
-        key += challenge_03.guess_with_frequency(block)[0]
+    for column in column_views(ciphertext, keysize):
+        key += challenge_03.guess_with_frequency(column, model)[0]
 
+    return bytes(key)
+
+
+if __name__ == '__main__':
+    # Optionally score with a model file written by language.py
+    model = language.load(sys.argv[1]) if len(sys.argv) > 1 else \
+        language.english
+    ciphertext = base64.b64decode(open("06.txt", "r").read())
+    key = break_repeating_xor(ciphertext, 40, model)
     plaintext = challenge_05.repeating_xor(key, ciphertext).decode()
 
     print("Key      : {}".format(key))
@@ -6,10 +6,170 @@
 # channel attacks, useful for educational purposes only.
 
 import base64
+import collections
+import concurrent.futures
+import functools
+import gf256
+import sys
+import threading
 import unittest
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class KeyScheduleCache():
+    """
+    Bounded LRU cache of expanded key schedules, keyed by key bytes. Keeps
+    count of hits and misses so the effect on an attack can be measured.
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self, capacity=256):
+        if capacity < 0:
+            raise ValueError("Invalid capacity")
+
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, expand):
+        """
+        Returns the schedule for a given key, calling expand(key) to create
+        it if it is not cached yet.
+        """
+        key = bytes(key)
+
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+            self.misses += 1
+
+        # Expand outside of the lock, so a slow expansion doesn't hold up
+        # lookups of other keys
+        schedule = expand(key)
+
+        with self.lock:
+            if self.capacity > 0:
+                self.entries[key] = schedule
+                self.__evict()
+
+        return schedule
+
+    def resize(self, capacity):
+        """
+        Changes the capacity, evicting the least recently used schedules if
+        the cache is now too large. A capacity of 0 disables caching.
+        """
+        if capacity < 0:
+            raise ValueError("Invalid capacity")
+
+        with self.lock:
+            self.capacity = capacity
+            self.__evict()
+
+    def clear(self):
+        """
+        Removes all cached schedules and resets the counters.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __evict(self):
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+
+class KeySchedule():
+    """
+    An expanded key and the other forms of it used by the different
+    backends. Only the byte schedule is computed up front, the rest on first
+    use by a backend that needs it, and then kept for every instance sharing
+    this schedule. Computing a form twice from two threads is harmless.
+    """
+
+    def __init__(self, key_schedule, nr, nb=4):
+        self.key_schedule = key_schedule
+        self.nr = nr
+        self.nb = nb
+
+    @functools.cached_property
+    def enc_words(self):
+        """
+        The key schedule as big-endian 32-bit words, one per state column,
+        for use with the T-table backend.
+        """
+        return tuple([int.from_bytes(self.key_schedule[i:i+4], 'big')
+                      for i in range(0, len(self.key_schedule), 4)])
+
+    @functools.cached_property
+    def dec_words(self):
+        """
+        The decryption key schedule as 32-bit words, following the
+        equivalent inverse cipher in Section 5.3.5 of FIPS-197: round keys
+        are used in reverse order and all but the first and last have
+        InvMixColumns applied to them.
+        """
+        nb = self.nb
+        words = self.enc_words
+        s_box = AES.s_box
+        dec_words = []
+
+        for round_num in range(self.nr, -1, -1):
+            for w in words[round_num * nb:(round_num+1) * nb]:
+                if 0 < round_num < self.nr:
+                    # Td tables include InvSubBytes, so undo it with the S-box
+                    # to get InvMixColumns on its own
+                    w = td0[s_box[w >> 24]] \
+                        ^ td1[s_box[(w >> 16) & 0xff]] \
+                        ^ td2[s_box[(w >> 8) & 0xff]] \
+                        ^ td3[s_box[w & 0xff]]
+                dec_words.append(w)
+
+        return tuple(dec_words)
+
+    @functools.cached_property
+    def inv_key_schedule(self):
+        """
+        The decryption key schedule as bytes, for the FIPS backend.
+        """
+        return b''.join([w.to_bytes(4, 'big') for w in self.dec_words])
+
+    @functools.cached_property
+    def round_keys(self):
+        """
+        The key schedule as a NumPy array with one round key per row, for
+        encrypt_blocks() and decrypt_blocks(). None without NumPy.
+        """
+        if numpy is None:
+            return None
+
+        round_keys = numpy.frombuffer(self.key_schedule, dtype=numpy.uint8)
+        return round_keys.reshape(self.nr + 1, 4 * self.nb)
+
 
 class AES():
+    """
+    AES block cipher for 128, 192 and 256-bit keys.
+
+    Instances are reentrant and thread-safe: the key schedule is immutable
+    after construction and every call works on its own local state, so one
+    instance can be shared by any number of threads (e.g. the workers of a
+    ThreadPoolExecutor) or asyncio tasks.
+    """
+
     # Number of rounds per key length (Nr)
     rounds_per_keysize = {
         16: 10,
@@ -94,62 +254,142 @@ class AES():
         0x21, 0x0c, 0x7d
     ]
 
-    def __init__(self, key):
+    # Available implementations of the block transform. "fips" follows
+    # FIPS-197 step by step, "ttable" combines SubBytes, ShiftRows and
+    # MixColumns into lookups on precomputed 32-bit round tables.
+    backends = ("fips", "ttable")
+
+    # Smallest buffer (in bytes) that encrypt_blocks() and decrypt_blocks()
+    # hand to NumPy. Below this, per-call array overhead costs more than
+    # transforming blocks one at a time.
+    min_vector_size = 64
+
+    # Key schedules shared by all instances
+    key_schedules = KeyScheduleCache()
+
+    def __init__(self, key, backend="fips"):
         if len(key) not in self.rounds_per_keysize:
             raise ValueError("Invalid key size")
 
+        if backend not in self.backends:
+            raise ValueError("Invalid backend")
+
         self.nk = self.words_per_keysize[len(key)]
         self.nr = self.rounds_per_keysize[len(key)]
-        self.state = [bytes(4) for row in range(self.nb)]
-        self.key_schedule = self.__expand_key(key)
+        self.backend = backend
+
+        # Expanded key schedules are cached by key, so creating ciphers for
+        # a key that was seen recently is just a dictionary lookup
+        self.schedule = self.key_schedules.get(key, self.__prepare_key)
+        self.key_schedule = self.schedule.key_schedule
 
     def encrypt(self, plaintext):
         if len(plaintext) != 4 * self.nb:
             raise ValueError("Invalid block size")
 
+        if self.backend == "ttable":
+            return self.__encrypt_ttable(plaintext)
+
         # Initial state is the provided plaintext
-        self.state = as_blocks(list(plaintext), self.nb)
+        state = as_blocks(list(plaintext), self.nb)
 
         # Add initial round key
-        self.__add_round_key(0)
+        self.__add_round_key(state, self.key_schedule, 0)
 
         # Apply rounds nr-1
         for i in range(1, self.nr):
-            self.__sub_bytes()
-            self.__shift_rows()
-            self.__mix_columns()
-            self.__add_round_key(i)
+            self.__sub_bytes(state)
+            self.__shift_rows(state)
+            self.__mix_columns(state)
+            self.__add_round_key(state, self.key_schedule, i)
 
         # Apply last round
-        self.__sub_bytes()
-        self.__shift_rows()
-        self.__add_round_key(self.nr)
+        self.__sub_bytes(state)
+        self.__shift_rows(state)
+        self.__add_round_key(state, self.key_schedule, self.nr)
 
-        return bytes(sum(self.state, []))
+        return bytes(sum(state, []))
 
     def decrypt(self, ciphertext):
         if len(ciphertext) != 4 * self.nb:
             raise ValueError("Invalid block size")
 
-        # Initial state is the provided ciphertext
-        self.state = as_blocks(list(ciphertext), self.nb)
+        if self.backend == "ttable":
+            return self.__decrypt_ttable(ciphertext)
 
-        # Apply last round first
-        self.__add_round_key(self.nr)
-        self.__inv_shift_rows()
-        self.__inv_sub_bytes()
+        # Initial state is the provided ciphertext. Decryption follows the
+        # equivalent inverse cipher (Section 5.3.5 of FIPS-197), which has
+        # the same sequence of steps as encryption but uses the decryption
+        # key schedule.
+        state = as_blocks(list(ciphertext), self.nb)
+
+        # Add last round key first
+        self.__add_round_key(state, self.schedule.inv_key_schedule, 0)
+
+        # Apply rounds nr-1
+        for i in range(1, self.nr):
+            self.__inv_sub_bytes(state)
+            self.__inv_shift_rows(state)
+            self.__inv_mix_columns(state)
+            self.__add_round_key(state, self.schedule.inv_key_schedule, i)
+
+        # Apply last round, which adds the initial round key
+        self.__inv_sub_bytes(state)
+        self.__inv_shift_rows(state)
+        self.__add_round_key(state, self.schedule.inv_key_schedule, self.nr)
+
+        return bytes(sum(state, []))
+
+    def encrypt_blocks(self, plaintext):
+        """
+        Encrypts a buffer holding any number of 16-byte blocks independently
+        (i.e. ECB). When NumPy is available, each round is applied to all
+        blocks at once instead of calling encrypt() per block.
+        """
+        if len(plaintext) % (4 * self.nb) != 0:
+            raise ValueError("Invalid block size")
+
+        if numpy is None or len(plaintext) < self.min_vector_size:
+            return b''.join([self.encrypt(block) for block in
+                            as_blocks(bytes(plaintext), 4 * self.nb)])
+
+        round_keys = self.schedule.round_keys
+        state = numpy.frombuffer(bytes(plaintext), dtype=numpy.uint8)
+        state = state.reshape(-1, 4 * self.nb) ^ round_keys[0]
+
+        for i in range(1, self.nr):
+            state = np_s_box[state][:, np_shift_rows]
+            state = np_mix_columns(state) ^ round_keys[i]
+
+        state = np_s_box[state][:, np_shift_rows] ^ round_keys[self.nr]
+
+        return state.tobytes()
+
+    def decrypt_blocks(self, ciphertext):
+        """
+        Decrypts a buffer holding any number of 16-byte blocks independently
+        (i.e. ECB). When NumPy is available, each round is applied to all
+        blocks at once instead of calling decrypt() per block.
+        """
+        if len(ciphertext) % (4 * self.nb) != 0:
+            raise ValueError("Invalid block size")
+
+        if numpy is None or len(ciphertext) < self.min_vector_size:
+            return b''.join([self.decrypt(block) for block in
+                            as_blocks(bytes(ciphertext), 4 * self.nb)])
+
+        round_keys = self.schedule.round_keys
+        state = numpy.frombuffer(bytes(ciphertext), dtype=numpy.uint8)
+        state = state.reshape(-1, 4 * self.nb) ^ round_keys[self.nr]
+        state = np_is_box[state[:, np_inv_shift_rows]]
 
-        # Apply rounds nr-1 in reverse order
         for i in range(self.nr-1, 0, -1):
-            self.__add_round_key(i)
-            self.__inv_mix_columns()
-            self.__inv_shift_rows()
-            self.__inv_sub_bytes()
+            state = np_inv_mix_columns(state ^ round_keys[i])
+            state = np_is_box[state[:, np_inv_shift_rows]]
 
-        # Add initial round key last
-        self.__add_round_key(0)
+        state ^= round_keys[0]
 
-        return bytes(sum(self.state, []))
+        return state.tobytes()
 
     def __expand_key(self, key):
         """
@@ -197,11 +437,98 @@ class AES():
 
         return round_keys
 
-    def __add_round_key(self, round_num):
+    def __prepare_key(self, key):
+        """
+        Expands a key into a KeySchedule, which derives the forms used by
+        the other backends when they are first needed. The byte schedule is
+        immutable so it can be shared between instances.
+        """
+        return KeySchedule(bytes(self.__expand_key(key)), self.nr, self.nb)
+
+    def __encrypt_ttable(self, plaintext):
         """
-        Adds a given round key to the state by performing an XOR operation.
-        Note that there is no inverse version of this function because the
-        inverse is equivalent to itself.
+        Encrypts a block using the T-table backend. The state is kept as four
+        32-bit column words and each round is 16 table lookups plus XORs.
+        """
+        rk = self.schedule.enc_words
+        s_box = self.s_box
+
+        s0 = int.from_bytes(plaintext[0:4], 'big') ^ rk[0]
+        s1 = int.from_bytes(plaintext[4:8], 'big') ^ rk[1]
+        s2 = int.from_bytes(plaintext[8:12], 'big') ^ rk[2]
+        s3 = int.from_bytes(plaintext[12:16], 'big') ^ rk[3]
+
+        # Apply rounds nr-1, where SubBytes, ShiftRows and MixColumns are
+        # combined in the round tables
+        for k in range(4, 4 * self.nr, 4):
+            t0 = te0[s0 >> 24] ^ te1[(s1 >> 16) & 0xff] \
+                ^ te2[(s2 >> 8) & 0xff] ^ te3[s3 & 0xff] ^ rk[k]
+            t1 = te0[s1 >> 24] ^ te1[(s2 >> 16) & 0xff] \
+                ^ te2[(s3 >> 8) & 0xff] ^ te3[s0 & 0xff] ^ rk[k+1]
+            t2 = te0[s2 >> 24] ^ te1[(s3 >> 16) & 0xff] \
+                ^ te2[(s0 >> 8) & 0xff] ^ te3[s1 & 0xff] ^ rk[k+2]
+            t3 = te0[s3 >> 24] ^ te1[(s0 >> 16) & 0xff] \
+                ^ te2[(s1 >> 8) & 0xff] ^ te3[s2 & 0xff] ^ rk[k+3]
+            s0, s1, s2, s3 = t0, t1, t2, t3
+
+        # Apply last round (no MixColumns, so use the S-box directly)
+        k = 4 * self.nr
+        t0 = (s_box[s0 >> 24] << 24 | s_box[(s1 >> 16) & 0xff] << 16
+              | s_box[(s2 >> 8) & 0xff] << 8 | s_box[s3 & 0xff]) ^ rk[k]
+        t1 = (s_box[s1 >> 24] << 24 | s_box[(s2 >> 16) & 0xff] << 16
+              | s_box[(s3 >> 8) & 0xff] << 8 | s_box[s0 & 0xff]) ^ rk[k+1]
+        t2 = (s_box[s2 >> 24] << 24 | s_box[(s3 >> 16) & 0xff] << 16
+              | s_box[(s0 >> 8) & 0xff] << 8 | s_box[s1 & 0xff]) ^ rk[k+2]
+        t3 = (s_box[s3 >> 24] << 24 | s_box[(s0 >> 16) & 0xff] << 16
+              | s_box[(s1 >> 8) & 0xff] << 8 | s_box[s2 & 0xff]) ^ rk[k+3]
+
+        return (t0 << 96 | t1 << 64 | t2 << 32 | t3).to_bytes(16, 'big')
+
+    def __decrypt_ttable(self, ciphertext):
+        """
+        Decrypts a block using the T-table backend and the equivalent inverse
+        cipher, which has the same structure as encryption.
+        """
+        rk = self.schedule.dec_words
+        is_box = self.is_box
+
+        s0 = int.from_bytes(ciphertext[0:4], 'big') ^ rk[0]
+        s1 = int.from_bytes(ciphertext[4:8], 'big') ^ rk[1]
+        s2 = int.from_bytes(ciphertext[8:12], 'big') ^ rk[2]
+        s3 = int.from_bytes(ciphertext[12:16], 'big') ^ rk[3]
+
+        # Apply rounds nr-1, where InvSubBytes, InvShiftRows and
+        # InvMixColumns are combined in the round tables
+        for k in range(4, 4 * self.nr, 4):
+            t0 = td0[s0 >> 24] ^ td1[(s3 >> 16) & 0xff] \
+                ^ td2[(s2 >> 8) & 0xff] ^ td3[s1 & 0xff] ^ rk[k]
+            t1 = td0[s1 >> 24] ^ td1[(s0 >> 16) & 0xff] \
+                ^ td2[(s3 >> 8) & 0xff] ^ td3[s2 & 0xff] ^ rk[k+1]
+            t2 = td0[s2 >> 24] ^ td1[(s1 >> 16) & 0xff] \
+                ^ td2[(s0 >> 8) & 0xff] ^ td3[s3 & 0xff] ^ rk[k+2]
+            t3 = td0[s3 >> 24] ^ td1[(s2 >> 16) & 0xff] \
+                ^ td2[(s1 >> 8) & 0xff] ^ td3[s0 & 0xff] ^ rk[k+3]
+            s0, s1, s2, s3 = t0, t1, t2, t3
+
+        # Apply last round (no InvMixColumns, so use the inverse S-box
+        # directly)
+        k = 4 * self.nr
+        t0 = (is_box[s0 >> 24] << 24 | is_box[(s3 >> 16) & 0xff] << 16
+              | is_box[(s2 >> 8) & 0xff] << 8 | is_box[s1 & 0xff]) ^ rk[k]
+        t1 = (is_box[s1 >> 24] << 24 | is_box[(s0 >> 16) & 0xff] << 16
+              | is_box[(s3 >> 8) & 0xff] << 8 | is_box[s2 & 0xff]) ^ rk[k+1]
+        t2 = (is_box[s2 >> 24] << 24 | is_box[(s1 >> 16) & 0xff] << 16
+              | is_box[(s0 >> 8) & 0xff] << 8 | is_box[s3 & 0xff]) ^ rk[k+2]
+        t3 = (is_box[s3 >> 24] << 24 | is_box[(s2 >> 16) & 0xff] << 16
+              | is_box[(s1 >> 8) & 0xff] << 8 | is_box[s0 & 0xff]) ^ rk[k+3]
+
+        return (t0 << 96 | t1 << 64 | t2 << 32 | t3).to_bytes(16, 'big')
+
+    def __add_round_key(self, state, key_schedule, round_num):
+        """
+        Adds a given round key from a key schedule to the state by performing
+        an XOR operation. Note that there is no inverse version of this
+        function because the inverse is equivalent to itself.
         """
         for i in range(4):
             for j in range(self.nb):
@@ -209,87 +536,273 @@ class AES():
                 # determine the correct key schedule offset (k) and add the
                 # round key bytes to the state
                 k = (round_num * self.nb * 4) + (i * self.nb) + j
-                self.state[i][j] ^= self.key_schedule[k]
+                state[i][j] ^= key_schedule[k]
 
-    def __sub_bytes(self):
+    def __sub_bytes(self, state):
         """
         Substitutes state values with S-box values.
         """
         for i in range(4):
             for j in range(self.nb):
-                self.state[i][j] = self.s_box[self.state[i][j]]
+                state[i][j] = self.s_box[state[i][j]]
 
-    def __shift_rows(self):
+    def __shift_rows(self, state):
         """
         Applies a left shift to state rows where the number of shifts is equal
         to the row number.
         """
-        self.state[0][1], self.state[1][1], self.state[2][1], \
-            self.state[3][1] = self.state[1][1], self.state[2][1], \
-            self.state[3][1], self.state[0][1]
-        self.state[0][2], self.state[1][2], self.state[2][2], \
-            self.state[3][2] = self.state[2][2], self.state[3][2], \
-            self.state[0][2], self.state[1][2]
-        self.state[0][3], self.state[1][3], self.state[2][3], \
-            self.state[3][3] = self.state[3][3], self.state[0][3], \
-            self.state[1][3], self.state[2][3]
+        state[0][1], state[1][1], state[2][1], state[3][1] = \
+            state[1][1], state[2][1], state[3][1], state[0][1]
+        state[0][2], state[1][2], state[2][2], state[3][2] = \
+            state[2][2], state[3][2], state[0][2], state[1][2]
+        state[0][3], state[1][3], state[2][3], state[3][3] = \
+            state[3][3], state[0][3], state[1][3], state[2][3]
 
-    def __mix_columns(self):
+    def __mix_columns(self, state):
         """
-        Applies a mixing function to the state columns.
+        Applies a mixing function to the state columns. Multiplication by 2
+        (xtime) is looked up in a precomputed table.
         """
+        mul2 = gf256.mul2
+
         for i in range(4):
-            tmp = self.state[i][0] ^ self.state[i][1] ^ self.state[i][2] \
-                ^ self.state[i][3]
-            first = self.state[i][0]
+            tmp = state[i][0] ^ state[i][1] ^ state[i][2] ^ state[i][3]
+            first = state[i][0]
 
-            self.state[i][0] ^= xtime(self.state[i][0] ^ self.state[i][1]) \
-                ^ tmp
-            self.state[i][1] ^= xtime(self.state[i][1] ^ self.state[i][2]) \
-                ^ tmp
-            self.state[i][2] ^= xtime(self.state[i][2] ^ self.state[i][3]) \
-                ^ tmp
-            self.state[i][3] ^= xtime(self.state[i][3] ^ first) ^ tmp
+            state[i][0] ^= mul2[state[i][0] ^ state[i][1]] ^ tmp
+            state[i][1] ^= mul2[state[i][1] ^ state[i][2]] ^ tmp
+            state[i][2] ^= mul2[state[i][2] ^ state[i][3]] ^ tmp
+            state[i][3] ^= mul2[state[i][3] ^ first] ^ tmp
 
-    def __inv_sub_bytes(self):
+    def __inv_sub_bytes(self, state):
         """
         Substitutes state values with inverse S-box values.
         """
         for i in range(4):
             for j in range(self.nb):
-                self.state[i][j] = self.is_box[self.state[i][j]]
+                state[i][j] = self.is_box[state[i][j]]
 
-    def __inv_shift_rows(self):
+    def __inv_shift_rows(self, state):
         """
         Applies a right shift to state rows where the number of shifts is equal
         to the row number.
         """
-        self.state[0][1], self.state[1][1], self.state[2][1], \
-            self.state[3][1] = self.state[3][1], self.state[0][1], \
-            self.state[1][1], self.state[2][1]
-        self.state[0][2], self.state[1][2], self.state[2][2], \
-            self.state[3][2] = self.state[2][2], self.state[3][2], \
-            self.state[0][2], self.state[1][2]
-        self.state[0][3], self.state[1][3], self.state[2][3], \
-            self.state[3][3] = self.state[1][3], self.state[2][3], \
-            self.state[3][3], self.state[0][3]
+        state[0][1], state[1][1], state[2][1], state[3][1] = \
+            state[3][1], state[0][1], state[1][1], state[2][1]
+        state[0][2], state[1][2], state[2][2], state[3][2] = \
+            state[2][2], state[3][2], state[0][2], state[1][2]
+        state[0][3], state[1][3], state[2][3], state[3][3] = \
+            state[1][3], state[2][3], state[3][3], state[0][3]
 
-    def __inv_mix_columns(self):
+    def __inv_mix_columns(self, state):
         """
-        Applies an inverse mixing function to the state columns. Uses
-        preprocessing as described in Section 4.1.3 of The Design of Rijndael.
-        The result is the same.
+        Applies an inverse mixing function to the state columns, using lookup
+        tables for multiplication by 9, 11, 13 and 14 so it costs the same as
+        the forward mixing function.
         """
+        mul9, mul11, mul13, mul14 = gf256.mul9, gf256.mul11, gf256.mul13, \
+            gf256.mul14
+
         for i in range(4):
-            u = xtime(xtime(self.state[i][0] ^ self.state[i][2]))
-            v = xtime(xtime(self.state[i][1] ^ self.state[i][3]))
+            a0, a1, a2, a3 = state[i]
+
+            state[i][0] = mul14[a0] ^ mul11[a1] ^ mul13[a2] ^ mul9[a3]
+            state[i][1] = mul9[a0] ^ mul14[a1] ^ mul11[a2] ^ mul13[a3]
+            state[i][2] = mul13[a0] ^ mul9[a1] ^ mul14[a2] ^ mul11[a3]
+            state[i][3] = mul11[a0] ^ mul13[a1] ^ mul9[a2] ^ mul14[a3]
+
+
+class BitslicedAES(AES):
+    """
+    AES evaluated on many blocks at once by bitslicing. Each of the 128 bits
+    of the state is held in its own Python integer (a bit plane), where bit n
+    of plane 8i+b is bit b of byte i in block n. SubBytes is evaluated as a
+    boolean circuit of XOR, AND and NOT gates, so one pass over the rounds
+    encrypts a whole batch of blocks using only big integer operations.
+    """
+
+    def __init__(self, key, lanes=4096):
+        super().__init__(key)
+
+        if lanes < 1:
+            raise ValueError("Invalid number of lanes")
+
+        # Number of blocks packed into each bit plane
+        self.lanes = lanes
+
+        # Bit planes that get flipped when adding each round key
+        self.key_flips = []
+
+        for i in range(self.nr + 1):
+            round_key = self.key_schedule[16 * i:16 * (i+1)]
+            self.key_flips.append([8 * j + b for j in range(16)
+                                   for b in range(8)
+                                   if round_key[j] >> b & 1])
+
+    def encrypt(self, plaintext):
+        if len(plaintext) != 4 * self.nb:
+            raise ValueError("Invalid block size")
+
+        return self.encrypt_blocks(plaintext)
+
+    def decrypt(self, ciphertext):
+        if len(ciphertext) != 4 * self.nb:
+            raise ValueError("Invalid block size")
+
+        return self.decrypt_blocks(ciphertext)
+
+    def encrypt_blocks(self, plaintext):
+        """
+        Encrypts a buffer holding any number of 16-byte blocks independently
+        (i.e. ECB), up to `lanes` blocks per pass.
+        """
+        return self.__process(plaintext, self.__encrypt_planes)
+
+    def decrypt_blocks(self, ciphertext):
+        """
+        Decrypts a buffer holding any number of 16-byte blocks independently
+        (i.e. ECB), up to `lanes` blocks per pass.
+        """
+        return self.__process(ciphertext, self.__decrypt_planes)
+
+    def __process(self, data, transform):
+        """
+        Splits data into batches of at most `lanes` blocks, converts each
+        batch to bit planes, applies a transform and converts it back.
+        """
+        block_size = 4 * self.nb
+
+        if len(data) % block_size != 0:
+            raise ValueError("Invalid block size")
+
+        data = bytes(data)
+        output = bytearray(len(data))
+        batch_size = self.lanes * block_size
+
+        for start in range(0, len(data), batch_size):
+            batch = data[start:start + batch_size]
+            n = len(batch) // block_size
+            planes = transform(to_bit_planes(batch), (1 << n) - 1)
+            output[start:start + len(batch)] = from_bit_planes(planes, n)
+
+        return bytes(output)
+
+    def __encrypt_planes(self, planes, ones):
+        self.__add_round_key(planes, 0, ones)
+
+        for i in range(1, self.nr):
+            planes = self.__sub_bytes(planes, ones)
+            planes = self.__shift_rows(planes, bitsliced_shift_rows)
+            planes = self.__mix_columns(planes)
+            self.__add_round_key(planes, i, ones)
+
+        planes = self.__sub_bytes(planes, ones)
+        planes = self.__shift_rows(planes, bitsliced_shift_rows)
+        self.__add_round_key(planes, self.nr, ones)
+
+        return planes
+
+    def __decrypt_planes(self, planes, ones):
+        self.__add_round_key(planes, self.nr, ones)
+
+        for i in range(self.nr-1, 0, -1):
+            planes = self.__shift_rows(planes, bitsliced_inv_shift_rows)
+            planes = self.__inv_sub_bytes(planes, ones)
+            self.__add_round_key(planes, i, ones)
+            planes = self.__inv_mix_columns(planes)
+
+        planes = self.__shift_rows(planes, bitsliced_inv_shift_rows)
+        planes = self.__inv_sub_bytes(planes, ones)
+        self.__add_round_key(planes, 0, ones)
+
+        return planes
+
+    def __add_round_key(self, planes, round_num, ones):
+        """
+        Adds a round key to the state. Since the round key is the same for
+        every block, this just inverts the planes where the key bit is set.
+        """
+        for j in self.key_flips[round_num]:
+            planes[j] ^= ones
+
+    def __shift_rows(self, planes, permutation):
+        """
+        Moves the 8 planes of each state byte to a new byte position.
+        """
+        return [planes[8 * j + b] for j in permutation for b in range(8)]
+
+    def __sub_bytes(self, planes, ones):
+        """
+        Substitutes every state byte by running the S-box circuit on its 8
+        planes.
+        """
+        output = []
+
+        for j in range(0, 128, 8):
+            output.extend(bitsliced_s_box(planes[j:j+8], ones))
 
-            self.state[i][0] ^= u
-            self.state[i][1] ^= v
-            self.state[i][2] ^= u
-            self.state[i][3] ^= v
+        return output
+
+    def __inv_sub_bytes(self, planes, ones):
+        """
+        Substitutes every state byte with the inverse S-box, which is computed
+        as A⁻¹(S(A⁻¹(x) ⊕ 0x05)) ⊕ 0x05 where A⁻¹ is the linear part of the
+        inverse affine transform. This reuses the forward S-box circuit.
+        """
+        output = []
+
+        for j in range(0, 128, 8):
+            x = bitsliced_inv_affine(planes[j:j+8])
+            x[0] ^= ones
+            x[2] ^= ones
+            x = bitsliced_inv_affine(bitsliced_s_box(x, ones))
+            x[0] ^= ones
+            x[2] ^= ones
+            output.extend(x)
+
+        return output
+
+    def __mix_columns(self, planes):
+        """
+        Applies the same mixing function as AES to each column, with xtime
+        done by rewiring planes.
+        """
+        output = []
 
-        self.__mix_columns()
+        for c in range(0, 128, 32):
+            a0 = planes[c:c+8]
+            a1 = planes[c+8:c+16]
+            a2 = planes[c+16:c+24]
+            a3 = planes[c+24:c+32]
+            tmp = [a0[b] ^ a1[b] ^ a2[b] ^ a3[b] for b in range(8)]
+
+            for x, y in ((a0, a1), (a1, a2), (a2, a3), (a3, a0)):
+                t = bitsliced_xtime([x[b] ^ y[b] for b in range(8)])
+                output.extend([x[b] ^ t[b] ^ tmp[b] for b in range(8)])
+
+        return output
+
+    def __inv_mix_columns(self, planes):
+        """
+        Applies the inverse mixing function using preprocessing as described
+        in Section 4.1.3 of The Design of Rijndael, so only the forward
+        mixing function is needed.
+        """
+        planes = planes[:]
+
+        for c in range(0, 128, 32):
+            u = bitsliced_xtime(bitsliced_xtime(
+                [planes[c+b] ^ planes[c+16+b] for b in range(8)]))
+            v = bitsliced_xtime(bitsliced_xtime(
+                [planes[c+8+b] ^ planes[c+24+b] for b in range(8)]))
+
+            for b in range(8):
+                planes[c+b] ^= u[b]
+                planes[c+8+b] ^= v[b]
+                planes[c+16+b] ^= u[b]
+                planes[c+24+b] ^= v[b]
+
+        return self.__mix_columns(planes)
 
 
 class Challenge7(unittest.TestCase):
@@ -337,6 +850,152 @@ class Challenge7(unittest.TestCase):
         self.assertEqual(ciphertext, bytes.fromhex(
             "00000000000000000000000000000000"))
 
+    def test_ttable_backend(self):
+        keys = ["10a58869d74be5a374cf867cfb473859",
+                "e9f065d7c13573587f7875357dfbb16c53489f6a4bd0f7cd",
+                "c47b0294dbbbee0fec4757f22ffeee3587ca4730c3d33b691df38bab076"
+                + "bc558"]
+        ciphertexts = ["6d251e6944b051e04eaa6fb4dbf78465",
+                       "0956259c9cd5cfd0181cca53380cde06",
+                       "46f2fb342d6f0ab477476fc501242c5f"]
+
+        for key, ciphertext in zip(keys, ciphertexts):
+            cipher = AES(bytes.fromhex(key), backend="ttable")
+            self.assertEqual(cipher.encrypt(bytes(16)),
+                             bytes.fromhex(ciphertext))
+            self.assertEqual(cipher.decrypt(bytes.fromhex(ciphertext)),
+                             bytes(16))
+
+        # Both backends must agree on arbitrary keys and blocks
+        for size in (16, 24, 32):
+            key = bytes(range(size))
+            fips = AES(key)
+            ttable = AES(key, backend="ttable")
+
+            for i in range(16):
+                block = bytes((i * 17 + j * 31) % 256 for j in range(16))
+                self.assertEqual(ttable.encrypt(block), fips.encrypt(block))
+                self.assertEqual(ttable.decrypt(block), fips.decrypt(block))
+
+    def test_encrypt_blocks(self):
+        for size in (16, 24, 32):
+            cipher = AES(bytes(range(size)))
+            plaintext = bytes(i % 251 for i in range(16 * 40))
+            blocks = as_blocks(plaintext, 16)
+            ciphertext = b''.join([cipher.encrypt(b) for b in blocks])
+
+            self.assertEqual(cipher.encrypt_blocks(plaintext), ciphertext)
+            self.assertEqual(cipher.decrypt_blocks(ciphertext), plaintext)
+            self.assertEqual(cipher.encrypt_blocks(plaintext[:16]),
+                             ciphertext[:16])
+
+        with self.assertRaises(ValueError):
+            cipher.encrypt_blocks(bytes(17))
+
+    def test_bitsliced(self):
+        cipher = BitslicedAES(bytes.fromhex(
+            "10a58869d74be5a374cf867cfb473859"))
+        self.assertEqual(cipher.encrypt(bytes(16)), bytes.fromhex(
+            "6d251e6944b051e04eaa6fb4dbf78465"))
+        self.assertEqual(cipher.decrypt(bytes.fromhex(
+            "6d251e6944b051e04eaa6fb4dbf78465")), bytes(16))
+
+        # Every S-box input in one batch, split over several passes
+        for size in (16, 24, 32):
+            key = bytes(range(size))
+            plaintext = bytes(range(256)) * 16
+            ciphertext = AES(key).encrypt_blocks(plaintext)
+            cipher = BitslicedAES(key, lanes=100)
+
+            self.assertEqual(cipher.encrypt_blocks(plaintext), ciphertext)
+            self.assertEqual(cipher.decrypt_blocks(ciphertext), plaintext)
+
+    def test_key_schedule_cache(self):
+        cache = KeyScheduleCache(2)
+        expanded = []
+
+        def expand(key):
+            expanded.append(key)
+            return key[::-1]
+
+        self.assertEqual(cache.get(b"a", expand), b"a")
+        self.assertEqual(cache.get([98], expand), b"b")
+        self.assertEqual(cache.get(b"a", expand), b"a")
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+        # "b" is the least recently used key, so it is evicted first
+        cache.get(b"c", expand)
+        cache.get(b"a", expand)
+        cache.get(b"b", expand)
+        self.assertEqual(expanded, [b"a", b"b", b"c", b"b"])
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+        cache.resize(1)
+        self.assertEqual(len(cache), 1)
+        cache.resize(0)
+        cache.get(b"b", expand)
+        self.assertEqual(len(cache), 0)
+
+        cache.clear()
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+        # Repeated keys only get expanded once
+        AES.key_schedules.clear()
+        for backend in AES.backends:
+            cipher = AES(bytes(16), backend=backend)
+            self.assertEqual(cipher.encrypt(bytes(16)), AES(bytes(16),
+                             backend=backend).encrypt(bytes(16)))
+        self.assertEqual(AES.key_schedules.misses, 1)
+        self.assertEqual(AES.key_schedules.hits, 3)
+
+        # The other backends' forms of the schedule are derived on first use
+        fips = AES(bytes(range(16)))
+        fips.encrypt(bytes(16))
+        lazy = ["enc_words", "dec_words", "inv_key_schedule", "round_keys"]
+        self.assertFalse([name for name in lazy
+                          if name in vars(fips.schedule)])
+
+        AES(bytes(range(16)), backend="ttable").encrypt(bytes(16))
+        self.assertIn("enc_words", vars(fips.schedule))
+        self.assertNotIn("dec_words", vars(fips.schedule))
+
+    def test_thread_safety(self):
+        ciphers = [AES(bytes(range(16)), backend=backend) for backend in
+                   AES.backends] + [BitslicedAES(bytes(range(16)))]
+        blocks = [bytes((i + j) % 256 for j in range(16)) for i in range(64)]
+        expected = [AES(bytes(range(16))).encrypt(b) for b in blocks]
+
+        def roundtrip(cipher, i):
+            ciphertext = cipher.encrypt(blocks[i])
+            plaintext = cipher.decrypt(ciphertext)
+            batch = cipher.decrypt_blocks(cipher.encrypt_blocks(
+                b''.join(blocks[i:i+8])))
+            return ciphertext, plaintext, batch
+
+        # Hammer a single instance from many threads at once, switching
+        # threads as often as possible to expose any shared state
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(16) as executor:
+                for cipher in ciphers:
+                    results = executor.map(
+                        lambda i: roundtrip(cipher, i % 64), range(512))
+
+                    for i, result in enumerate(results):
+                        ciphertext, plaintext, batch = result
+                        self.assertEqual(ciphertext, expected[i % 64])
+                        self.assertEqual(plaintext, blocks[i % 64])
+                        self.assertEqual(batch, b''.join(
+                            blocks[i % 64:i % 64 + 8]))
+        finally:
+            sys.setswitchinterval(interval)
+
+    def test_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            AES(bytes(16), backend="unknown")
+
 
 def as_blocks(data, size):
     """
@@ -370,6 +1029,287 @@ def rotate_word(word):
     word[3] = first
 
 
+def round_tables(box, coefficients):
+    """
+    Builds four 256-entry tables of 32-bit words for a given S-box and column
+    of MixColumns coefficients. Entry x of the first table is the column
+    produced by substituting x and multiplying it by each coefficient. The
+    other three tables are the same words rotated right by 8, 16 and 24 bits.
+    """
+    table = []
+
+    for x in range(256):
+        word = 0
+        for c in coefficients:
+            word = (word << 8) | gf256.gmul(box[x], c)
+        table.append(word)
+
+    tables = [table]
+
+    for shift in (8, 16, 24):
+        tables.append([(w >> shift | w << (32 - shift)) & 0xffffffff
+                       for w in table])
+
+    return tables
+
+
+# Round tables for the T-table backend, computed once at import. Te combines
+# SubBytes and MixColumns, Td combines InvSubBytes and InvMixColumns.
+te0, te1, te2, te3 = round_tables(AES.s_box, (2, 1, 1, 3))
+td0, td1, td2, td3 = round_tables(AES.is_box, (14, 9, 13, 11))
+
+
+def np_mix_columns(state):
+    """
+    Applies MixColumns to an N×16 array of states using the multiply-by-2
+    lookup table.
+    """
+    cols = state.reshape(-1, 4, 4)
+    a0, a1, a2, a3 = cols[:, :, 0], cols[:, :, 1], cols[:, :, 2], \
+        cols[:, :, 3]
+    out = numpy.empty_like(cols)
+
+    # 3·x is 2·x ⊕ x
+    out[:, :, 0] = np_mul2[a0] ^ np_mul2[a1] ^ a1 ^ a2 ^ a3
+    out[:, :, 1] = a0 ^ np_mul2[a1] ^ np_mul2[a2] ^ a2 ^ a3
+    out[:, :, 2] = a0 ^ a1 ^ np_mul2[a2] ^ np_mul2[a3] ^ a3
+    out[:, :, 3] = np_mul2[a0] ^ a0 ^ a1 ^ a2 ^ np_mul2[a3]
+
+    return out.reshape(-1, 16)
+
+
+def np_inv_mix_columns(state):
+    """
+    Applies InvMixColumns to an N×16 array of states using the multiply-by-9,
+    11, 13 and 14 lookup tables.
+    """
+    cols = state.reshape(-1, 4, 4)
+    a0, a1, a2, a3 = cols[:, :, 0], cols[:, :, 1], cols[:, :, 2], \
+        cols[:, :, 3]
+    out = numpy.empty_like(cols)
+
+    out[:, :, 0] = np_mul14[a0] ^ np_mul11[a1] ^ np_mul13[a2] ^ np_mul9[a3]
+    out[:, :, 1] = np_mul9[a0] ^ np_mul14[a1] ^ np_mul11[a2] ^ np_mul13[a3]
+    out[:, :, 2] = np_mul13[a0] ^ np_mul9[a1] ^ np_mul14[a2] ^ np_mul11[a3]
+    out[:, :, 3] = np_mul11[a0] ^ np_mul13[a1] ^ np_mul9[a2] ^ np_mul14[a3]
+
+    return out.reshape(-1, 16)
+
+
+def to_bit_planes(data):
+    """
+    Converts a buffer of n 16-byte blocks into 128 bit planes. Each column of
+    bytes (data[i::16]) is turned into 8 planes by translating every byte to
+    an ASCII "0" or "1" for one bit and parsing the result in base 2.
+    """
+    planes = []
+
+    for i in range(16):
+        column = data[i::16]
+
+        for b in range(8):
+            planes.append(int(column.translate(bit_tables[b])[::-1], 2))
+
+    return planes
+
+
+def from_bit_planes(planes, n):
+    """
+    Converts 128 bit planes back into a buffer of n 16-byte blocks.
+    """
+    output = bytearray(16 * n)
+    fmt = "0{}b".format(n)
+    low_bits = int.from_bytes(b"\x01" * n, 'little')
+
+    for i in range(16):
+        column = 0
+
+        for b in range(8):
+            # Spread the plane out so that bit b of every byte is set
+            bits = format(planes[8 * i + b], fmt).encode()[::-1]
+            column |= (int.from_bytes(bits, 'little') & low_bits) << b
+
+        output[i::16] = column.to_bytes(n, 'little')
+
+    return bytes(output)
+
+
+def bitsliced_xtime(a):
+    """
+    Multiplies 8 bit planes (least significant first) by 2 in GF(2^8). This is
+    a shift where bit 7 is reduced into bits 0, 1, 3 and 4.
+    """
+    return [a[7], a[0] ^ a[7], a[1], a[2] ^ a[7], a[3] ^ a[7], a[4], a[5],
+            a[6]]
+
+
+def bitsliced_inv_affine(a):
+    """
+    Applies the linear part of the inverse S-box affine transform to 8 bit
+    planes (least significant first).
+    """
+    return [a[(b+2) % 8] ^ a[(b+5) % 8] ^ a[(b+7) % 8] for b in range(8)]
+
+
+def bitsliced_s_box(a, ones):
+    """
+    Evaluates the AES S-box on 8 bit planes (least significant first) using
+    the 113-gate circuit by Boyar and Peralta (see "A depth-16 circuit for the
+    AES S-box", 2011). ones has a bit set for every lane in use and stands in
+    for NOT.
+    """
+    x0, x1, x2, x3, x4, x5, x6, x7 = a[7], a[6], a[5], a[4], a[3], a[2], \
+        a[1], a[0]
+
+    # Top linear transformation
+    y14 = x3 ^ x5
+    y13 = x0 ^ x6
+    y9 = x0 ^ x3
+    y8 = x0 ^ x5
+    t0 = x1 ^ x2
+    y1 = t0 ^ x7
+    y4 = y1 ^ x3
+    y12 = y13 ^ y14
+    y2 = y1 ^ x0
+    y5 = y1 ^ x6
+    y3 = y5 ^ y8
+    t1 = x4 ^ y12
+    y15 = t1 ^ x5
+    y20 = t1 ^ x1
+    y6 = y15 ^ x7
+    y10 = y15 ^ t0
+    y11 = y20 ^ y9
+    y7 = x7 ^ y11
+    y17 = y10 ^ y11
+    y19 = y10 ^ y8
+    y16 = t0 ^ y11
+    y21 = y13 ^ y16
+    y18 = x0 ^ y16
+
+    # Non-linear section (inversion in GF(2^8))
+    t2 = y12 & y15
+    t3 = y3 & y6
+    t4 = t3 ^ t2
+    t5 = y4 & x7
+    t6 = t5 ^ t2
+    t7 = y13 & y16
+    t8 = y5 & y1
+    t9 = t8 ^ t7
+    t10 = y2 & y7
+    t11 = t10 ^ t7
+    t12 = y9 & y11
+    t13 = y14 & y17
+    t14 = t13 ^ t12
+    t15 = y8 & y10
+    t16 = t15 ^ t12
+    t17 = t4 ^ t14
+    t18 = t6 ^ t16
+    t19 = t9 ^ t14
+    t20 = t11 ^ t16
+    t21 = t17 ^ y20
+    t22 = t18 ^ y19
+    t23 = t19 ^ y21
+    t24 = t20 ^ y18
+
+    t25 = t21 ^ t22
+    t26 = t21 & t23
+    t27 = t24 ^ t26
+    t28 = t25 & t27
+    t29 = t28 ^ t22
+    t30 = t23 ^ t24
+    t31 = t22 ^ t26
+    t32 = t31 & t30
+    t33 = t32 ^ t24
+    t34 = t23 ^ t33
+    t35 = t27 ^ t33
+    t36 = t24 & t35
+    t37 = t36 ^ t34
+    t38 = t27 ^ t36
+    t39 = t29 & t38
+    t40 = t25 ^ t39
+
+    t41 = t40 ^ t37
+    t42 = t29 ^ t33
+    t43 = t29 ^ t40
+    t44 = t33 ^ t37
+    t45 = t42 ^ t41
+    z0 = t44 & y15
+    z1 = t37 & y6
+    z2 = t33 & x7
+    z3 = t43 & y16
+    z4 = t40 & y1
+    z5 = t29 & y7
+    z6 = t42 & y11
+    z7 = t45 & y17
+    z8 = t41 & y10
+    z9 = t44 & y12
+    z10 = t37 & y3
+    z11 = t33 & y4
+    z12 = t43 & y13
+    z13 = t40 & y5
+    z14 = t29 & y2
+    z15 = t42 & y9
+    z16 = t45 & y14
+    z17 = t41 & y8
+
+    # Bottom linear transformation
+    t46 = z15 ^ z16
+    t47 = z10 ^ z11
+    t48 = z5 ^ z13
+    t49 = z9 ^ z10
+    t50 = z2 ^ z12
+    t51 = z2 ^ z5
+    t52 = z7 ^ z8
+    t53 = z0 ^ z3
+    t54 = z6 ^ z7
+    t55 = z16 ^ z17
+    t56 = z12 ^ t48
+    t57 = t50 ^ t53
+    t58 = z4 ^ t46
+    t59 = z3 ^ t54
+    t60 = t46 ^ t57
+    t61 = z14 ^ t57
+    t62 = t52 ^ t58
+    t63 = t49 ^ t58
+    t64 = z4 ^ t59
+    t65 = t61 ^ t62
+    t66 = z1 ^ t63
+    s0 = t59 ^ t63
+    s6 = t56 ^ t62 ^ ones
+    s7 = t48 ^ t60 ^ ones
+    t67 = t64 ^ t65
+    s3 = t53 ^ t66
+    s4 = t51 ^ t66
+    s5 = t47 ^ t65
+    s1 = t64 ^ s3 ^ ones
+    s2 = t55 ^ t67 ^ ones
+
+    return [s7, s6, s5, s4, s3, s2, s1, s0]
+
+
+# Lookup tables and ShiftRows permutations for encrypt_blocks() and
+# decrypt_blocks(). State byte 4c+r holds row r of column c, so ShiftRows
+# takes output byte 4c+r from input column (c+r) mod 4.
+if numpy is not None:
+    np_s_box = numpy.array(AES.s_box, dtype=numpy.uint8)
+    np_is_box = numpy.array(AES.is_box, dtype=numpy.uint8)
+    np_mul2, np_mul9, np_mul11, np_mul13, np_mul14 = [
+        numpy.array(table, dtype=numpy.uint8) for table in
+        (gf256.mul2, gf256.mul9, gf256.mul11, gf256.mul13, gf256.mul14)]
+    np_shift_rows = numpy.array([4 * ((c + r) % 4) + r for c in range(4)
+                                 for r in range(4)])
+    np_inv_shift_rows = numpy.argsort(np_shift_rows)
+
+
+# Tables used by to_bit_planes() to map every byte to ASCII "0" or "1" for
+# each bit position, and the byte permutations for ShiftRows on bit planes.
+bit_tables = [bytes(0x30 + (x >> b & 1) for x in range(256))
+              for b in range(8)]
+bitsliced_shift_rows = [4 * ((c + r) % 4) + r for c in range(4)
+                        for r in range(4)]
+bitsliced_inv_shift_rows = [bitsliced_shift_rows.index(j) for j in range(16)]
+
+
 if __name__ == '__main__':
     cipher = AES(b"YELLOW SUBMARINE")
     ciphertext = base64.b64decode(open("07.txt", "r").read())
@@ -2,8 +2,49 @@
 #
 # https://cryptopals.com/sets/1/challenges/8
 
+import argparse
 import base64
-import challenge_07
+import binascii
+import collections
+import hashlib
+import heapq
+import os
+import sys
+import time
+import unittest
+import batches
+
+
+class Challenge8(unittest.TestCase):
+    def test_scan_records(self):
+        with open("08.txt", "r") as f:
+            results = scan_records(f, top=3, batch_size=50, workers=2)
+
+        self.assertEqual(len(results), 1)
+        repeats, record_number, count, block, cross = results[0]
+        self.assertEqual((repeats, record_number, count), (3, 133, 4))
+        self.assertEqual(cross, None)
+
+    def test_cross_record_repeats(self):
+        blocks = [os.urandom(16) for _ in range(4)]
+        records = [(blocks[0] + blocks[1] + blocks[0]).hex(),
+                   (blocks[2] + blocks[3]).hex(), "not hex",
+                   (blocks[1] + blocks[2]).hex()]
+        results = scan_records(records, top=10, workers=1,
+                               bloom_bits=1 << 16)
+
+        # Records are ranked by repeats within the record, then by blocks
+        # seen in earlier records
+        self.assertEqual([r[:3] for r in results], [(1, 1, 2), (0, 4, 1)])
+        self.assertEqual([r[4] for r in results], [0, 2])
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1 << 12)
+        fingerprints = [fingerprint(os.urandom(16)) for _ in range(100)]
+
+        self.assertFalse(any([bloom.add(fp) for fp in fingerprints]))
+        self.assertTrue(all([fp in bloom for fp in fingerprints]))
+        self.assertTrue(all([bloom.add(fp) for fp in fingerprints]))
 
 
 def detect_aes_ecb(blocks):
@@ -17,18 +58,201 @@ def detect_aes_ecb(blocks):
     return block, histogram[block]
 
 
+def fingerprint(block):
+    """
+    Returns a 64-bit hash of a block, for the Bloom filter.
+    """
+    return int.from_bytes(hashlib.blake2b(block, digest_size=8).digest(),
+                          'little')
+
+
+class BloomFilter():
+    """
+    Fixed-size set of fingerprints that can answer "possibly seen" or
+    "definitely not seen". The bit positions for a fingerprint come from
+    its two 32-bit halves by double hashing.
+    """
+
+    def __init__(self, bits=1 << 27, hashes=4):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+
+    def positions(self, fp):
+        h1, h2 = fp & 0xffffffff, (fp >> 32) | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, fp):
+        return all([self.array[p >> 3] & (1 << (p & 7))
+                    for p in self.positions(fp)])
+
+    def add(self, fp):
+        """
+        Adds a fingerprint, and returns whether it was possibly seen before.
+        """
+        seen = True
+
+        for p in self.positions(fp):
+            if not self.array[p >> 3] & (1 << (p & 7)):
+                seen = False
+                self.array[p >> 3] |= 1 << (p & 7)
+
+        return seen
+
+
+def decode_record(line, encoding):
+    line = line.strip()
+
+    if encoding == "hex":
+        return bytes.fromhex(line)
+
+    return base64.b64decode(line, validate=True)
+
+
+def scan_batch(batch, top, encoding="hex", block_size=16,
+               fingerprints=False):
+    """
+    Worker for scan_records(). Counts repeated blocks in each (record
+    number, line) pair in batch with an exact per-record histogram, and
+    returns the number of bytes scanned and results as (repeats, -record
+    number, highest block count, most repeated block, fingerprints).
+    Records that can't be decoded are skipped.
+
+    Only the top results are returned, unless fingerprints is set: then
+    every record comes back with the fingerprints of its distinct blocks,
+    for the Bloom filter in the parent.
+    """
+    results = []
+    scanned = 0
+
+    for record_number, line in batch:
+        try:
+            ciphertext = decode_record(line, encoding)
+        except (ValueError, binascii.Error):
+            continue
+
+        scanned += len(ciphertext)
+        end = len(ciphertext) - len(ciphertext) % block_size
+        histogram = collections.Counter(
+            [ciphertext[i:i + block_size] for i in range(0, end, block_size)])
+
+        if not histogram:
+            continue
+
+        block, count = histogram.most_common(1)[0]
+        repeats = end // block_size - len(histogram)
+        prints = [fingerprint(b) for b in histogram] if fingerprints \
+            else None
+
+        results.append((repeats, -record_number, count, block, prints))
+
+    if not fingerprints:
+        results = heapq.nlargest(top, results)
+
+    return scanned, results
+
+
+def scan_records(lines, top=10, batch_size=1000, workers=None,
+                 encoding="hex", block_size=16, bloom_bits=None,
+                 report=None):
+    """
+    Ranks records (lines of hex or base64) by how many of their blocks
+    repeat, which is the sign of ECB mode. Lines are read lazily and handed
+    to a pool of worker processes in batches, with only a few batches in
+    flight at a time. Returns (repeats, record number, highest block count,
+    most repeated block, cross-record repeats) for records with any repeats,
+    best first.
+
+    With bloom_bits, a Bloom filter of that many bits also counts each
+    record's distinct blocks that were possibly seen in records scanned
+    before it (in the order batches complete), and ranks by that second.
+    Like any Bloom filter it can give false positives, more so as it fills
+    up. Otherwise cross-record repeats are None.
+
+    report(records, n_bytes, seconds) is called as batches complete.
+    """
+    bloom = BloomFilter(bloom_bits) if bloom_bits else None
+    heap = []
+    records = 0
+    scanned = 0
+    start = time.perf_counter()
+
+    def merge(size, batch_result):
+        nonlocal records, scanned
+        n_bytes, results = batch_result
+        records += size
+        scanned += n_bytes
+
+        for repeats, record_number, count, block, prints in results:
+            cross = None
+
+            if bloom is not None:
+                cross = sum([bloom.add(fp) for fp in prints])
+
+            if not repeats and not cross:
+                continue
+
+            batches.push_top(heap, top, (repeats, cross or 0, record_number,
+                                         count, block, cross))
+
+        if report is not None:
+            report(records, scanned, time.perf_counter() - start)
+
+    batches.map_batches(lines, scan_batch,
+                        (top, encoding, block_size, bloom is not None),
+                        merge, batch_size, workers)
+
+    return [(repeats, -record_number, count, block, cross)
+            for repeats, _, record_number, count, block, cross in
+            sorted(heap, reverse=True)]
+
+
 if __name__ == '__main__':
-    max_score = 0
-    block = b""
+    parser = argparse.ArgumentParser(
+        description="Find records encrypted with AES in ECB mode.")
+    parser.add_argument("input", nargs="*", default=["08.txt"],
+                        help="files with one record per line, or - for "
+                        "stdin (default: 08.txt)")
+    parser.add_argument("--encoding", choices=("hex", "base64"),
+                        default="hex")
+    parser.add_argument("--top", type=int, default=1,
+                        help="number of suspects to show (default: 1)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number "
+                        "of CPUs)")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="records per batch (default: 1000)")
+    parser.add_argument("--bloom-bits", type=int, default=None,
+                        help="also count blocks repeated across records, "
+                        "with a Bloom filter of this many bits")
+    args = parser.parse_args()
+
+    def report(records, n_bytes, seconds):
+        rate = 1 / seconds if seconds else 0
+        sys.stderr.write("\r{} records, {} bytes in {:.2f} s ({:.0f} "
+                         "records/s, {:.2f} MB/s)".format(
+                             records, n_bytes, seconds, records * rate,
+                             n_bytes * rate / 1e6))
+        sys.stderr.flush()
+
+    def read_lines(paths):
+        for path in paths:
+            if path == "-":
+                yield from sys.stdin
+            else:
+                with open(path, "r") as f:
+                    yield from f
 
-    for line in open("08.txt", "r"):
-        ciphertext = base64.b64decode(line)
-        blocks = challenge_07.as_blocks(ciphertext, 16)
-        guessed_block, score = detect_aes_ecb(blocks)
+    results = scan_records(read_lines(args.input), args.top,
+                           args.batch_size, args.workers, args.encoding,
+                           bloom_bits=args.bloom_bits, report=report)
+    sys.stderr.write("\n")
 
-        if score > max_score:
-            max_score = score
-            block = guessed_block
+    for repeats, record_number, count, block, cross in results:
+        print("Record              : {}".format(record_number))
+        print("Likely AES ECB Block: {}".format(block))
+        print("Highest Score       : {}".format(count))
+        print("Repeated blocks     : {}".format(repeats))
 
-    print("Likely AES ECB Block: {}".format(block))
-    print("Highest Score       : {}".format(max_score))
+        if cross is not None:
+            print("Seen in other record: {}".format(cross))
@@ -2,58 +2,179 @@
 #
 # https://cryptopals.com/sets/2/challenges/10
 
+import batches
 import challenge_02
 import challenge_07
 import challenge_09
 import base64
+import functools
+import io
 import unittest
 
 
 class AES_CBC:
+    """
+    AES in CBC mode with PKCS#7 padding. The IV is fixed at construction and
+    never updated, so like challenge_07.AES an instance can be shared between
+    threads.
+    """
+
     def __init__(self, key, iv):
         if len(iv) != 16:
             raise ValueError("Invalid length of IV")
 
+        self.key = bytes(key)
         self.cipher = challenge_07.AES(key)
         self.iv = iv
 
     def encrypt(self, plaintext):
-        # Apply padding so all blocks end up as 16 bytes
-        plaintext = challenge_09.pkcs7(plaintext, 16)
+        encryptor = self.encryptor()
+        return encryptor.update(plaintext) + encryptor.finalize()
 
-        # Break the plaintext up into blocks
-        blocks = challenge_07.as_blocks(plaintext, 16)
+    def decrypt(self, ciphertext):
+        if len(ciphertext) % 16 != 0:
+            raise ValueError("Invalid length of ciphertext")
 
-        # First block is the result of encrypt(blocks[0] ^ IV)
-        blocks[0] = self.cipher.encrypt(challenge_02.fixed_xor(blocks[0],
-                                        self.iv))
+        decryptor = self.decryptor()
+        return decryptor.update(ciphertext) + decryptor.finalize()
 
-        # All other blocks are the result of encrypt(blocks[i] ^ blocks[i-1])
-        for i in range(1, len(blocks)):
-            blocks[i] = self.cipher.encrypt(challenge_02.fixed_xor(
-                                            blocks[i], blocks[i-1]))
+    def decrypt_parallel(self, ciphertext, workers=None):
+        """
+        Decrypts on a pool of worker processes. Each plaintext block only
+        depends on two ciphertext blocks, so the ciphertext is split into one
+        chunk per worker, where every chunk also reads the last block of the
+        chunk before it. Input and output are passed through shared memory
+        rather than pickled.
+        """
+        if len(ciphertext) % 16 != 0 or len(ciphertext) == 0:
+            raise ValueError("Invalid length of ciphertext")
 
-        return b''.join(blocks)
+        plaintext = batches.map_shared(
+            ciphertext, functools.partial(decrypt_chunk, self.key,
+                                          bytes(self.iv)), workers)
 
-    def decrypt(self, ciphertext):
-        if len(ciphertext) % 16 != 0:
-            raise ValueError("Invalid length of ciphertext")
+        return challenge_09.remove_pkcs7(plaintext, 16)
+
+    def encryptor(self):
+        """
+        Returns an object for encrypting a message incrementally.
+        """
+        return AES_CBC_Encryptor(self.cipher, self.iv)
+
+    def decryptor(self):
+        """
+        Returns an object for decrypting a message incrementally.
+        """
+        return AES_CBC_Decryptor(self.cipher, self.iv)
+
+    def encrypt_stream(self, src, dst, chunk_size=1 << 16):
+        """
+        Encrypts everything read from a binary file-like object (such as an
+        open file, or socket.makefile("rb")) and writes the ciphertext to
+        another one. At most chunk_size bytes are held in memory at once.
+        """
+        return transform_stream(self.encryptor(), src, dst, chunk_size)
+
+    def decrypt_stream(self, src, dst, chunk_size=1 << 16):
+        """
+        Decrypts everything read from a binary file-like object and writes
+        the plaintext to another one. At most chunk_size bytes are held in
+        memory at once.
+        """
+        return transform_stream(self.decryptor(), src, dst, chunk_size)
+
+
+class AES_CBC_Encryptor:
+    """
+    Incremental CBC encryption. Each call to update() returns the ciphertext
+    for all complete blocks received so far and carries the last ciphertext
+    block over to the next call. PKCS#7 padding is only applied by finalize().
+    """
 
-        # Break the ciphertext up into blocks
-        blocks = challenge_07.as_blocks(ciphertext, 16)
-        decrypted = blocks
+    def __init__(self, cipher, iv):
+        self.cipher = cipher
+        self.previous = bytes(iv)
+        self.buffer = bytearray()
+        self.finalized = False
 
-        # All but the first decrypted block are the result of
-        # decrypt(blocks[i]) ^ blocks[i-1]
-        for i in range(len(decrypted)-1, 0, -1):
-            decrypted[i] = challenge_02.fixed_xor(self.cipher.decrypt(
-                                                  blocks[i]), blocks[i-1])
+    def update(self, data):
+        if self.finalized:
+            raise ValueError("Encryptor has already been finalized")
 
-        # First decrypted block is the result of decrypt(blocks[0]) ^ IV
-        decrypted[0] = challenge_02.fixed_xor(self.cipher.decrypt(blocks[0]),
-                                              self.iv)
+        self.buffer += data
+        n = len(self.buffer) - len(self.buffer) % 16
+        output = bytearray(n)
 
-        return challenge_09.remove_pkcs7(b''.join(decrypted), 16)
+        # Each block is the result of encrypt(block ^ previous block), where
+        # the first previous block is the IV
+        for i in range(0, n, 16):
+            block = challenge_02.fixed_xor(self.buffer[i:i+16],
+                                           self.previous)
+            self.previous = self.cipher.encrypt(block)
+            output[i:i+16] = self.previous
+
+        del self.buffer[:n]
+
+        return bytes(output)
+
+    def finalize(self):
+        # Apply padding to what is left, so the last block ends up as 16
+        # bytes (or a whole block of padding is added)
+        last = challenge_09.pkcs7(bytes(self.buffer), 16)
+        self.buffer = bytearray()
+        output = self.update(last)
+        self.finalized = True
+
+        return output
+
+
+class AES_CBC_Decryptor:
+    """
+    Incremental CBC decryption. Each call to update() returns the plaintext
+    for all complete blocks received so far, except for the most recent one
+    which might hold padding. PKCS#7 padding is only checked and removed by
+    finalize().
+    """
+
+    def __init__(self, cipher, iv):
+        self.cipher = cipher
+        self.previous = bytes(iv)
+        self.buffer = bytearray()
+        self.finalized = False
+
+    def update(self, data):
+        if self.finalized:
+            raise ValueError("Decryptor has already been finalized")
+
+        self.buffer += data
+
+        # Hold back the last block (complete or not) until finalize()
+        n = (len(self.buffer) - 1) // 16 * 16
+
+        if n <= 0:
+            return b""
+
+        # Every block in the chunk can be decrypted in one batch. Plaintext
+        # blocks are the result of decrypt(block) ^ previous block, where the
+        # first previous block is the IV or the end of the last chunk.
+        ciphertext = bytes(self.buffer[:n])
+        decrypted = self.cipher.decrypt_blocks(ciphertext)
+        previous = self.previous + ciphertext[:-16]
+        self.previous = ciphertext[-16:]
+        del self.buffer[:n]
+
+        return challenge_02.fixed_xor(decrypted, previous)
+
+    def finalize(self):
+        if len(self.buffer) != 16:
+            raise ValueError("Invalid length of ciphertext")
+
+        block = self.cipher.decrypt(bytes(self.buffer))
+        plaintext = challenge_02.fixed_xor(block, self.previous)
+        self.buffer = bytearray()
+        self.finalized = True
+
+        return challenge_09.remove_pkcs7(plaintext, 16)
 
 
 class Challenge10(unittest.TestCase):
@@ -62,16 +183,104 @@ class Challenge10(unittest.TestCase):
         cipher = AES_CBC(bytes.fromhex("2b7e151628aed2a6abf7158809cf4f3c"), iv)
         ciphertext = cipher.encrypt(bytes.fromhex(
                                     "6bc1bee22e409f96e93d7e117393172a"))
-        self.assertEqual(ciphertext, [bytes.fromhex(
-                                      "7649abac8119b246cee98e9b12e9197d")])
+        self.assertEqual(ciphertext[:16], bytes.fromhex(
+                                          "7649abac8119b246cee98e9b12e9197d"))
 
     def test_decrypt(self):
+        key = bytes.fromhex("2b7e151628aed2a6abf7158809cf4f3c")
         iv = bytes.fromhex("7649ABAC8119B246CEE98E9B12E9197D")
-        cipher = AES_CBC(bytes.fromhex("2b7e151628aed2a6abf7158809cf4f3c"), iv)
-        plaintext = cipher.decrypt(bytes.fromhex(
-                                   "5086cb9b507219ee95db113a917678b2"))
-        self.assertEqual(plaintext, [bytes.fromhex(
-                                     "ae2d8a571e03ac9c9eb76fac45af8e51")])
+        cipher = AES_CBC(key, iv)
+        ciphertext = bytes.fromhex("5086cb9b507219ee95db113a917678b2")
+
+        # Append a block of PKCS#7 padding to the test vector
+        ciphertext += challenge_07.AES(key).encrypt(challenge_02.fixed_xor(
+            b"\x10" * 16, ciphertext))
+
+        plaintext = cipher.decrypt(ciphertext)
+        self.assertEqual(plaintext, bytes.fromhex(
+                                    "ae2d8a571e03ac9c9eb76fac45af8e51"))
+
+    def test_streaming(self):
+        cipher = AES_CBC(b"YELLOW SUBMARINE", bytes(range(16)))
+
+        for size in (0, 1, 15, 16, 17, 100, 1000):
+            plaintext = bytes(i % 256 for i in range(size))
+            ciphertext = cipher.encrypt(plaintext)
+
+            # Feed uneven chunks so blocks straddle calls to update()
+            for chunk_size in (1, 7, 16, 33):
+                encryptor = cipher.encryptor()
+                decryptor = cipher.decryptor()
+                encrypted = b""
+                decrypted = b""
+
+                for i in range(0, size, chunk_size):
+                    encrypted += encryptor.update(plaintext[i:i+chunk_size])
+                encrypted += encryptor.finalize()
+
+                for i in range(0, len(encrypted), chunk_size):
+                    decrypted += decryptor.update(encrypted[i:i+chunk_size])
+                decrypted += decryptor.finalize()
+
+                self.assertEqual(encrypted, ciphertext)
+                self.assertEqual(decrypted, plaintext)
+
+            src = io.BytesIO(ciphertext)
+            dst = io.BytesIO()
+            self.assertEqual(cipher.decrypt_stream(src, dst, 48), size)
+            self.assertEqual(dst.getvalue(), plaintext)
+
+        decryptor = cipher.decryptor()
+        decryptor.update(bytes(20))
+        with self.assertRaises(ValueError):
+            decryptor.finalize()
+
+    def test_decrypt_parallel(self):
+        cipher = AES_CBC(b"YELLOW SUBMARINE", bytes(range(16)))
+        plaintext = bytes(i % 251 for i in range(5000))
+        ciphertext = cipher.encrypt(plaintext)
+
+        for workers in (1, 3):
+            self.assertEqual(cipher.decrypt_parallel(ciphertext, workers),
+                             plaintext)
+
+        with self.assertRaises(challenge_09.PaddingError):
+            cipher.decrypt_parallel(ciphertext[:-16] + bytes(16), 2)
+
+        with self.assertRaises(ValueError):
+            cipher.decrypt_parallel(bytes(20))
+
+
+def decrypt_chunk(key, iv, src, dst, start, end):
+    """
+    Worker for AES_CBC.decrypt_parallel(). Decrypts src[start:end] into dst,
+    using the block before start (or the IV) as the first previous block.
+    """
+    ciphertext = bytes(src[start:end])
+    previous = iv if start == 0 else bytes(src[start-16:start])
+    decrypted = challenge_07.AES(key).decrypt_blocks(ciphertext)
+    dst[start:end] = challenge_02.fixed_xor(decrypted,
+                                            previous + ciphertext[:-16])
+
+
+def transform_stream(transformer, src, dst, chunk_size):
+    """
+    Feeds chunks read from src through an encryptor or decryptor and writes
+    the output to dst. Returns the number of bytes written.
+    """
+    written = 0
+
+    while True:
+        chunk = src.read(chunk_size)
+
+        if not chunk:
+            break
+
+        written += dst.write(transformer.update(chunk))
+
+    written += dst.write(transformer.finalize())
+
+    return written
 
 
 if __name__ == '__main__':
@@ -10,6 +10,11 @@ import challenge_10
 
 
 class AES_ECB:
+    """
+    AES in ECB mode with PKCS#7 padding. Like challenge_07.AES, an instance
+    can be shared between threads.
+    """
+
     def __init__(self, key):
         self.cipher = challenge_07.AES(key)
 
@@ -17,27 +22,17 @@ class AES_ECB:
         # Apply padding so all blocks end up as 16 bytes
         plaintext = challenge_09.pkcs7(plaintext, 16)
 
-        # Break the plaintext up into blocks
-        blocks = challenge_07.as_blocks(plaintext, 16)
-
         # All blocks are encrypted individually
-        for i in range(len(blocks)):
-            blocks[i] = self.cipher.encrypt(blocks[i])
-
-        return b''.join(blocks)
+        return self.cipher.encrypt_blocks(plaintext)
 
     def decrypt(self, ciphertext):
         if len(ciphertext) % 16 != 0:
             raise ValueError("Invalid length of ciphertext")
 
-        # Break the ciphertext up into blocks
-        blocks = challenge_07.as_blocks(ciphertext, 16)
-
         # All blocks are decrypted individually
-        for i in range(len(blocks)):
-            blocks[i] = self.cipher.decrypt(blocks[i])
+        plaintext = self.cipher.decrypt_blocks(ciphertext)
 
-        return challenge_09.remove_pkcs7(b''.join(blocks), 16)
+        return challenge_09.remove_pkcs7(plaintext, 16)
 
 
 def random_key_or_iv():
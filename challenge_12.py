@@ -4,7 +4,11 @@
 
 import random
 import base64
+import concurrent.futures
+import threading
+import time
 import unittest
+import challenge_07
 import challenge_11
 
 secret = base64.b64decode("Um9sbGluJyBpbiBteSA1LjAKV2l0aCBteSByYWctdG9wIGRv"
@@ -25,13 +29,67 @@ class Challenge12(unittest.TestCase):
         self.assertEqual(mode, 'ecb')
 
     def test_plaintext_recovery(self):
-        plaintext = recover_plaintext(encryption_oracle)
+        oracle = CountingOracle(encryption_oracle)
+        plaintext = recover_plaintext(oracle)
         self.assertEqual(plaintext, secret)
 
+        batched_oracle = CountingOracle(encryption_oracle)
+        plaintext = recover_plaintext_batched(batched_oracle)
+        self.assertEqual(plaintext, secret)
+
+        # One query per byte, plus a few to find the block size
+        self.assertLessEqual(batched_oracle.queries, len(secret) + 16)
+        self.assertGreater(oracle.queries, 50 * batched_oracle.queries)
+
+    def test_parallel_recovery(self):
+        batched_oracle = CountingOracle(encryption_oracle)
+        recover_plaintext_batched(batched_oracle)
+
+        def slow_oracle(plaintext):
+            time.sleep(0.005)
+            return encryption_oracle(plaintext)
+
+        for workers in (1, 4):
+            oracle = CountingOracle(slow_oracle)
+            plaintext = recover_plaintext_parallel(oracle, workers)
+            self.assertEqual(plaintext, secret)
+
+            # One extra query per alignment, made side by side
+            self.assertEqual(oracle.queries, batched_oracle.queries + 16)
+            self.assertEqual(oracle.max_in_flight, workers)
+
+
+class CountingOracle():
+    """
+    Wraps an oracle and counts how many times it is queried, and the most
+    queries that were in flight at once.
+    """
+
+    def __init__(self, oracle):
+        self.oracle = oracle
+        self.queries = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, plaintext):
+        with self.lock:
+            self.queries += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        try:
+            return self.oracle(plaintext)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
 
 def deterministic_random_key():
-    random.seed(12)
-    return [random.getrandbits(8) for _ in range(16)]
+    # A generator of our own rather than the shared one, so that oracles can
+    # be queried from several threads at once
+    rng = random.Random(12)
+    return [rng.getrandbits(8) for _ in range(16)]
 
 
 def encryption_oracle(plaintext):
@@ -68,7 +126,7 @@ def recover_plaintext(oracle):
     each block until the entire ciphertext is decrypted.
     """
     plaintext = bytearray()
-    block_size, text_size, _ = determine_block_stats(encryption_oracle)
+    block_size, text_size, _ = determine_block_stats(oracle)
 
     for i in range(1, text_size+1):
         # Pad so that AES-128-ECB(padding || recovered plaintext) leaves only
@@ -91,6 +149,92 @@ def recover_plaintext(oracle):
     return bytes(plaintext)
 
 
+def recover_plaintext_batched(oracle, block_size=None, text_size=None,
+                              prefix_size=0):
+    """
+    Same attack as recover_plaintext(), but with a single query per byte.
+    Instead of asking the oracle about one guess at a time, every query
+    starts with a dictionary of all 256 guesses for the unknown byte, each
+    a whole block (the 15 bytes before it and then the guess), followed by
+    the padding that puts the unknown byte at the end of a block. The
+    ciphertext of the dictionary then works as a codebook for the target
+    block in the same response.
+
+    prefix_size is the length of any unknown data the oracle puts before
+    our input, as in challenge 14.
+    """
+    if block_size is None:
+        block_size, text_size, _ = determine_block_stats(oracle)
+
+    # Fill up the last block of the prefix so that our blocks are aligned
+    fill = b"A" * (-prefix_size % block_size)
+    first_byte = prefix_size + len(fill)
+    plaintext = bytearray()
+
+    for i in range(text_size):
+        padding = b"A" * (block_size - 1 - i % block_size)
+        known = (padding + plaintext)[-(block_size - 1):]
+        dictionary = b"".join([known + bytes([n]) for n in range(256)])
+
+        ciphertext = oracle(fill + dictionary + padding)
+        blocks = challenge_07.as_blocks(ciphertext[first_byte:], block_size)
+        codebook = {block: n for n, block in enumerate(blocks[:256])}
+        target = blocks[256 + (len(padding) + i) // block_size]
+
+        if target not in codebook:
+            break
+
+        plaintext.append(codebook[target])
+
+    return bytes(plaintext)
+
+
+def recover_plaintext_parallel(oracle, workers=4, block_size=None,
+                               text_size=None, prefix_size=0):
+    """
+    Byte-at-a-time decryption for a slow oracle, using a thread pool for the
+    queries that don't depend on each other.
+
+    A query with a given amount of padding holds the target block of every
+    byte at that alignment, so the block_size alignments are queried once
+    each, up front and up to workers at a time. Each byte can only be looked
+    up in a codebook made from the bytes before it, though, so the codebooks
+    are still fetched one at a time, one round trip per byte. Compared with
+    recover_plaintext_batched() this costs block_size extra queries and
+    doesn't make the per-byte round trips any shorter.
+    """
+    if block_size is None:
+        block_size, text_size, _ = determine_block_stats(oracle)
+
+    fill = b"A" * (-prefix_size % block_size)
+    first_byte = prefix_size + len(fill)
+
+    def blocks(plaintext):
+        ciphertext = oracle(fill + plaintext)
+        return challenge_07.as_blocks(ciphertext[first_byte:], block_size)
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        alignments = list(executor.map(
+            blocks, [b"A" * n for n in range(block_size)]))
+
+    plaintext = bytearray()
+
+    for i in range(text_size):
+        padding = block_size - 1 - i % block_size
+        known = (b"A" * padding + plaintext)[-(block_size - 1):]
+        dictionary = b"".join([known + bytes([n]) for n in range(256)])
+        codebook = {block: n for n, block in
+                    enumerate(blocks(dictionary)[:256])}
+        target = alignments[padding][(padding + i) // block_size]
+
+        if target not in codebook:
+            break
+
+        plaintext.append(codebook[target])
+
+    return bytes(plaintext)
+
+
 def detect_mode(oracle):
     plaintext = b"A" * 128
     return challenge_11.detect_mode(oracle(plaintext))
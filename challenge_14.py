@@ -15,15 +15,30 @@ class Challenge14(unittest.TestCase):
         self.assertEqual(offset, len(deterministic_random_bytes()))
 
     def test_plaintext_recovery(self):
-        plaintext = recover_plaintext(encryption_oracle)
+        oracle = challenge_12.CountingOracle(encryption_oracle)
+        plaintext = recover_plaintext(oracle)
+        self.assertEqual(plaintext, challenge_12.secret)
+
+        batched_oracle = challenge_12.CountingOracle(encryption_oracle)
+        plaintext = recover_plaintext_batched(batched_oracle)
+        self.assertEqual(plaintext, challenge_12.secret)
+
+        # One query per byte, plus up to a few blocks' worth of queries to
+        # find the block size and offset
+        self.assertLessEqual(batched_oracle.queries,
+                             len(challenge_12.secret) + 64)
+        self.assertGreater(oracle.queries, 50 * batched_oracle.queries)
+
+    def test_parallel_recovery(self):
+        plaintext = recover_plaintext_parallel(encryption_oracle)
         self.assertEqual(plaintext, challenge_12.secret)
 
 
 def deterministic_random_bytes():
-    random.seed(14)
-    size = random.randint(100, 1000)
+    rng = random.Random(14)
+    size = rng.randint(100, 1000)
 
-    return bytes([random.getrandbits(8) for _ in range(size)])
+    return bytes([rng.getrandbits(8) for _ in range(size)])
 
 
 def encryption_oracle(plaintext):
@@ -91,5 +106,29 @@ def recover_plaintext(oracle):
     return plaintext
 
 
+def recover_plaintext_batched(oracle):
+    """
+    Like recover_plaintext(), but asks the oracle once per byte using a
+    codebook of all 256 guesses (see challenge_12.recover_plaintext_batched).
+    """
+    block_size, text_size, _ = challenge_12.determine_block_stats(oracle)
+    offset = determine_offset(oracle, block_size)
+
+    return challenge_12.recover_plaintext_batched(
+        oracle, block_size, text_size - offset, offset)
+
+
+def recover_plaintext_parallel(oracle, workers=4):
+    """
+    Like recover_plaintext_batched(), but with the alignments queried side
+    by side up front (see challenge_12.recover_plaintext_parallel).
+    """
+    block_size, text_size, _ = challenge_12.determine_block_stats(oracle)
+    offset = determine_offset(oracle, block_size)
+
+    return challenge_12.recover_plaintext_parallel(
+        oracle, workers, block_size, text_size - offset, offset)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,34 +2,115 @@
 #
 # https://cryptopals.com/sets/3/challenges/18
 
+import batches
 import challenge_07
+import concurrent.futures
+import functools
 import unittest
 import base64
+import xor
 
 
 class AES_CTR:
-    def __init__(self, key):
+    """
+    AES in CTR mode, with a 64-bit nonce followed by a 64-bit little-endian
+    block counter. The nonce can be given once at construction or passed to
+    each call. No counter state is kept between calls, so like
+    challenge_07.AES an instance can be shared between threads.
+    """
+
+    def __init__(self, key, nonce=b"\x00"):
+        if len(nonce) > 8:
+            raise ValueError("Invalid length of nonce")
+
+        self.key = bytes(key)
         self.cipher = challenge_07.AES(key)
+        self.nonce = nonce
 
-    def encrypt(self, plaintext, nonce):
-        blocks = challenge_07.as_blocks(plaintext, 16)
-        keystream = b""
-        ciphertext = b""
+    def encrypt(self, plaintext, nonce=None):
+        keystream = self.keystream(0, len(plaintext), nonce)
+        return xor.xor(plaintext, keystream)
 
-        # Produce the blocks we need for our keystream
-        for i in range(len(blocks)):
-            nonce_padded = nonce + b"\x00" * (8 - len(nonce))
-            counter = bytes([i])
-            counter_padded = counter + b"\x00" * (8 - len(counter))
-            keystream += self.cipher.encrypt(nonce_padded + counter_padded)
+    def decrypt(self, ciphertext, nonce=None):
+        return self.encrypt(ciphertext, nonce)
 
-        for i, c in enumerate(plaintext):
-            ciphertext += bytes([c ^ keystream[i]])
+    def encrypt_parallel(self, plaintext, nonce=None, workers=None):
+        """
+        Encrypts on a pool of worker processes. The counter space is split
+        into one contiguous range of blocks per worker, and each worker writes
+        its keystream XOR plaintext directly into a preallocated shared
+        output buffer, working through its range in large chunks.
+        """
+        if nonce is None:
+            nonce = self.nonce
 
-        return ciphertext
+        return batches.map_shared(
+            plaintext, functools.partial(encrypt_chunk, self.key,
+                                         bytes(nonce), cls=type(self)),
+            workers)
 
-    def decrypt(self, ciphertext, nonce):
-        return self.encrypt(ciphertext, nonce)
+    def decrypt_parallel(self, ciphertext, nonce=None, workers=None):
+        return self.encrypt_parallel(ciphertext, nonce, workers)
+
+    def keystream(self, offset, length, nonce=None):
+        """
+        Returns length bytes of keystream starting at a given byte offset,
+        generating only the blocks that cover that range.
+        """
+        if offset < 0 or length < 0:
+            raise ValueError("Invalid keystream range")
+
+        if length == 0:
+            return b""
+
+        first = offset // 16
+        last = (offset + length - 1) // 16
+        counters = self.counter_blocks(first, last + 1, nonce)
+        skip = offset % 16
+
+        return self.cipher.encrypt_blocks(counters)[skip:skip + length]
+
+    def counter_blocks(self, start, end, nonce=None):
+        """
+        Returns the concatenated counter blocks (nonce || counter) for block
+        numbers start up to (but not including) end.
+        """
+        if nonce is None:
+            nonce = self.nonce
+
+        if len(nonce) > 8:
+            raise ValueError("Invalid length of nonce")
+
+        if end > 1 << 64:
+            raise ValueError("Counter overflow")
+
+        nonce_padded = bytes(nonce) + b"\x00" * (8 - len(nonce))
+
+        return b"".join([nonce_padded + i.to_bytes(8, 'little')
+                         for i in range(start, end)])
+
+    def edit(self, ciphertext, offset, newtext, nonce=None):
+        """
+        Returns a copy of ciphertext where the plaintext starting at offset is
+        replaced with newtext. Only the keystream for the edited range is
+        generated.
+        """
+        if offset > len(ciphertext):
+            raise ValueError("Invalid offset")
+
+        edited = bytearray(ciphertext)
+        self.edit_into(edited, offset, newtext, nonce)
+
+        return bytes(edited)
+
+    def edit_into(self, buffer, offset, newtext, nonce=None):
+        """
+        Replaces the plaintext starting at offset with newtext, in place in a
+        writable buffer (such as a bytearray or an mmap of an encrypted file).
+        """
+        keystream = self.keystream(offset, len(newtext), nonce)
+        buffer[offset:offset + len(newtext)] = newtext
+        xor.xor_into(buffer, keystream, offset)
 
 
 class Challenge18(unittest.TestCase):
@@ -42,6 +123,82 @@ class Challenge18(unittest.TestCase):
         self.assertEqual(cipher.decrypt(ciphertext, b"\x00").decode(),
                          plaintext)
 
+    def test_counter(self):
+        cipher = AES_CTR(b"YELLOW SUBMARINE", b"nonce")
+        block = challenge_07.AES(b"YELLOW SUBMARINE").encrypt(
+            b"nonce\x00\x00\x00" + (1000).to_bytes(8, 'little'))
+
+        # Counter keeps going past 256 blocks
+        keystream = cipher.encrypt(bytes(16 * 1001))
+        self.assertEqual(keystream[16 * 1000:], block)
+        self.assertEqual(cipher.keystream(16 * 1000, 16), block)
+
+        for offset, length in ((0, 0), (0, 5), (3, 40), (16, 16),
+                               (15985, 31)):
+            self.assertEqual(cipher.keystream(offset, length),
+                             keystream[offset:offset + length])
+
+    def test_edit(self):
+        cipher = AES_CTR(b"YELLOW SUBMARINE")
+        plaintext = bytes(i % 256 for i in range(1000))
+        ciphertext = cipher.encrypt(plaintext)
+
+        for offset, newtext in ((0, b"abc"), (17, b"x" * 40), (990, b"y" * 20),
+                                (1000, b"z")):
+            edited = bytearray(plaintext)
+            edited[offset:offset + len(newtext)] = newtext
+            expected = cipher.encrypt(edited)
+
+            self.assertEqual(cipher.edit(ciphertext, offset, newtext),
+                             expected)
+
+            buffer = bytearray(ciphertext)
+            cipher.edit_into(buffer, offset, newtext)
+            self.assertEqual(buffer, expected)
+
+        with self.assertRaises(ValueError):
+            cipher.edit(ciphertext, 1001, b"a")
+
+    def test_encrypt_parallel(self):
+        cipher = AES_CTR(b"YELLOW SUBMARINE", b"nonce")
+        plaintext = bytes(i % 251 for i in range(5000))
+        ciphertext = cipher.encrypt(plaintext)
+
+        for workers in (1, 3):
+            self.assertEqual(cipher.encrypt_parallel(plaintext, None,
+                                                     workers), ciphertext)
+            self.assertEqual(cipher.decrypt_parallel(ciphertext, b"nonce",
+                                                     workers), plaintext)
+
+        self.assertEqual(cipher.encrypt_parallel(b""), b"")
+
+    def test_shared_between_threads(self):
+        cipher = AES_CTR(b"YELLOW SUBMARINE")
+        plaintexts = [bytes([i]) * (i + 1) for i in range(100)]
+        expected = [cipher.encrypt(p, bytes([i % 8])) for i, p in
+                    enumerate(plaintexts)]
+
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            results = executor.map(
+                lambda i: cipher.encrypt(plaintexts[i], bytes([i % 8])),
+                range(100))
+            self.assertEqual(list(results), expected)
+
+
+def encrypt_chunk(key, nonce, src, dst, start, end, chunk_size=1 << 16,
+                  cls=AES_CTR):
+    """
+    Worker for AES_CTR.encrypt_parallel(). Encrypts src[start:end] into dst,
+    chunk_size bytes at a time. cls is the class of the calling instance, so
+    subclasses with a different counter layout get their own keystream.
+    """
+    cipher = cls(key, nonce)
+
+    for offset in range(start, end, chunk_size):
+        n = min(chunk_size, end - offset)
+        keystream = cipher.keystream(offset, n)
+        dst[offset:offset + n] = xor.xor(src[offset:offset + n], keystream)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,8 +3,18 @@
 # https://cryptopals.com/sets/3/challenges/19
 
 import challenge_18
+import challenge_20
+import language
 import random
 import base64
+import unittest
+import xor
+
+try:
+    import numpy
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:
+    numpy = None
 
 
 def deterministic_random_key():
@@ -26,6 +36,10 @@ def generate_ciphertexts():
 
 
 def repeated_chars(a, b):
+    """
+    Counts the positions where a and b have the same byte. See
+    similarity_matrix() for all pairs at once.
+    """
     repeats = 0
 
     if len(a) > len(b):
@@ -38,34 +52,163 @@ def repeated_chars(a, b):
     return repeats
 
 
-if __name__ == '__main__':
-    ciphertexts = generate_ciphertexts()
+def similarity_matrix(ciphertexts):
+    """
+    Returns an n × n NumPy matrix counting, for every pair of ciphertexts,
+    the positions where both have the same byte. Under a fixed nonce the
+    same byte means the same plaintext byte. The diagonal holds the length
+    of each ciphertext.
+
+    Each column is sorted by byte value to group the rows that are equal
+    there, and every group adds one to the block of counts between its rows,
+    so the work is proportional to the number of equal pairs.
+    """
+    matrix, mask = challenge_20.ciphertext_matrix(ciphertexts)
+    counts = numpy.zeros((len(ciphertexts), len(ciphertexts)), numpy.int64)
+
+    for column, present in zip(matrix.T, mask.T):
+        rows = numpy.nonzero(present)[0]
+        rows = rows[numpy.argsort(column[rows], kind="stable")]
+        values = column[rows]
+        starts = numpy.flatnonzero(numpy.diff(values)) + 1
+
+        for group in numpy.split(rows, starts):
+            counts[numpy.ix_(group, group)] += 1
+
+    return counts
+
+
+def most_similar(ciphertexts):
+    """
+    Returns for each ciphertext the index of the other ciphertext with the
+    most equal bytes, or None if there are no others.
+    """
+    counts = similarity_matrix(ciphertexts)
+
+    if len(ciphertexts) < 2:
+        return [None] * len(ciphertexts)
+
+    numpy.fill_diagonal(counts, -1)
+    return counts.argmax(axis=1).tolist()
+
+
+def crib_drag(ciphertexts, crib, top=10, model=language.english):
+    """
+    Tries crib at every offset of every ciphertext, and returns the top
+    guesses as (score, row, offset, keystream).
+
+    Each guess fixes len(crib) bytes of keystream at that offset, and is
+    scored by how English it makes every ciphertext's bytes at those
+    positions. Rather than decrypting the columns for each guess, all keys
+    of all columns are scored once, so a guess costs len(crib) lookups into
+    that table. With a unigram model the scores come from the column
+    histograms (as in challenge 20), otherwise each column is ranked
+    separately.
+    """
+    crib = numpy.frombuffer(crib, numpy.uint8)
+    matrix, mask = challenge_20.ciphertext_matrix(ciphertexts)
+    width = matrix.shape[1]
+
+    if len(crib) == 0 or len(crib) > width:
+        return []
+
+    if isinstance(model, language.UnigramModel):
+        key_scores = model.key_scores(challenge_20.column_histograms(
+            ciphertexts))
+    else:
+        key_scores = numpy.zeros((width, 256))
+
+        for i, column in enumerate(
+                challenge_20.transpose_ciphertexts(ciphertexts)):
+            for key, score in model.rank_keys(column):
+                key_scores[i, key] = score
+
+    # Keystream implied by every (row, offset), and whether the crib fits
+    windows = sliding_window_view(matrix, len(crib), axis=1)
+    keystreams = windows ^ crib
+    fits = sliding_window_view(mask, len(crib), axis=1).all(axis=2)
+
+    columns = numpy.arange(windows.shape[1])[:, None] + \
+        numpy.arange(len(crib))
+    scores = key_scores[columns, keystreams].sum(axis=2)
+    scores[~fits] = -numpy.inf
+
+    best = numpy.argsort(scores, axis=None, kind="stable")[::-1][:top]
+    rows, offsets = numpy.unravel_index(best, scores.shape)
+
+    return [(float(scores[r, o]), int(r), int(o), keystreams[r, o].tobytes())
+            for r, o in zip(rows, offsets) if fits[r, o]]
+
+
+def apply_keystream(ciphertexts, offset, keystream):
+    """
+    Decrypts the bytes of every ciphertext that a keystream fragment
+    starting at offset covers, e.g. to see the result of a crib_drag()
+    guess on all rows.
+    """
+    return [xor.xor(c[offset:offset + len(keystream)],
+                    keystream[:max(len(c) - offset, 0)])
+            for c in ciphertexts]
+
+
+@unittest.skipIf(numpy is None, "requires NumPy")
+class Challenge19(unittest.TestCase):
+    def test_similarity_matrix(self):
+        ciphertexts = generate_ciphertexts()
+        counts = similarity_matrix(ciphertexts)
+
+        for i, a in enumerate(ciphertexts):
+            for j, b in enumerate(ciphertexts):
+                self.assertEqual(counts[i, j], repeated_chars(a, b))
+
+        self.assertEqual(len(most_similar(ciphertexts)), len(ciphertexts))
+
+    def test_column_histograms(self):
+        ciphertexts = generate_ciphertexts()
+        histograms = challenge_20.column_histograms(ciphertexts)
+
+        self.assertEqual(histograms.sum(), sum(len(c) for c in ciphertexts))
+        self.assertEqual(histograms[0, ciphertexts[0][0]],
+                         sum(c[0] == ciphertexts[0][0] for c in ciphertexts))
 
-    # Find most similar ciphertexts
-    for i, ciphertext_a in enumerate(ciphertexts):
-        other_ciphertexts = ciphertexts[:i] + ciphertexts[i+1:]
-        most_repeats = 0
-        most_alike_ciphertext = None
+    def test_crib_drag(self):
+        ciphertexts = generate_ciphertexts()
+        crib = b"have met them"
+        guesses = crib_drag(ciphertexts, crib, top=3)
 
-        for ciphertext_b in other_ciphertexts:
-            repeats = repeated_chars(ciphertext_a, ciphertext_b)
+        score, row, offset, keystream = guesses[0]
+        self.assertEqual((row, offset), (0, 2))
+        self.assertEqual(apply_keystream(ciphertexts, offset, keystream)[4],
+                         b"have passed w")
+        self.assertEqual(guesses, sorted(guesses, reverse=True))
+
+        self.assertEqual(crib_drag(ciphertexts, b"x" * 1000), [])
 
-            if repeats > most_repeats:
-                most_repeats = repeats
-                most_alike_ciphertext = ciphertext_b
+        guesses = crib_drag(ciphertexts, crib, top=3,
+                            model=language.english_chi_squared)
+        self.assertEqual(guesses[0][1:3], (0, 2))
+        self.assertEqual(guesses, sorted(guesses, reverse=True))
 
-        print(ciphertext_a)
-        print(most_alike_ciphertext)
-        print("")
 
-    # Find most frequent characters in ciphertexts
-    frequencies = dict()
+if __name__ == '__main__':
+    ciphertexts = generate_ciphertexts()
+
+    # Find most similar ciphertexts
+    for ciphertext, other in zip(ciphertexts, most_similar(ciphertexts)):
+        print(ciphertext)
+        print(ciphertexts[other] if other is not None else None)
+        print("")
 
-    for ciphertext in ciphertexts:
-        for b in ciphertext:
-            frequencies[bytes([b])] = frequencies.get(bytes([b]), 0) + 1
+    # Find most frequent bytes in each column
+    histograms = challenge_20.column_histograms(ciphertexts)
 
-    print(sorted(frequencies.items(), key=lambda x: x[1]))
+    for i, histogram in enumerate(histograms):
+        common = histogram.argsort()[::-1][:3]
+        print(i, [(bytes([b]), int(histogram[b])) for b in common
+                  if histogram[b]])
 
-    # OK, enough experimenting for now... This approach is definitely
-    # suboptimal.
+    # Drag a crib across every line and show where it fits best
+    for score, row, offset, keystream in crib_drag(ciphertexts, b" the ",
+                                                   top=3):
+        print(score, row, offset,
+              apply_keystream(ciphertexts, offset, keystream)[:5])
@@ -2,11 +2,19 @@
 #
 # https://cryptopals.com/sets/3/challenges/20
 
-import challenge_03
-import challenge_05
 import challenge_18
+import language
+import math
 import random
 import base64
+import sys
+import unittest
+import xor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 def deterministic_random_key():
@@ -27,23 +35,156 @@ def generate_ciphertexts():
     return ciphertexts
 
 
-def transpose_ciphertexts(ciphertexts):
-    return [bytes(c) for c in zip(*ciphertexts)]
+def ciphertext_matrix(ciphertexts):
+    """
+    Returns the ciphertexts as the rows of a NumPy matrix, padded with zeros
+    to the length of the longest one, and a boolean mask of which entries
+    are real ciphertext bytes. The matrix is filled from the joined
+    ciphertexts in one go rather than byte by byte.
+    """
+    lengths = numpy.fromiter((len(c) for c in ciphertexts), numpy.int64,
+                             len(ciphertexts))
+    width = int(lengths.max(initial=0))
+    flat = numpy.frombuffer(b"".join([bytes(c) for c in ciphertexts]),
+                            numpy.uint8)
+
+    mask = numpy.arange(width) < lengths[:, None]
+    matrix = numpy.zeros((len(ciphertexts), width), numpy.uint8)
+    matrix[mask] = flat
 
+    return matrix, mask
 
-def attack_repeating_ctr_nonce(ciphertexts):
-    keystream = b""
 
-    for ciphertext in transpose_ciphertexts(ciphertexts):
-        keystream += challenge_03.guess_with_frequency(ciphertext)[0]
+def column_histograms(ciphertexts):
+    """
+    Returns a width × 256 array counting each byte value in each column of
+    the ciphertexts, where columns past the end of a ciphertext are left
+    out.
+    """
+    matrix, mask = ciphertext_matrix(ciphertexts)
+    columns = numpy.nonzero(mask)[1]
+    counts = numpy.bincount(columns * 256 + matrix[mask],
+                            minlength=256 * matrix.shape[1])
 
-    return keystream
+    return counts.reshape(-1, 256)
+
+
+def transpose_ciphertexts(ciphertexts):
+    """
+    Returns the columns of the ciphertexts, i.e. for each position the bytes
+    that were XORed with the same keystream byte. Columns run out to the
+    longest ciphertext, so later columns hold fewer bytes.
+    """
+    if numpy is None:
+        width = max(len(c) for c in ciphertexts)
+        return [bytes([c[i] for c in ciphertexts if i < len(c)])
+                for i in range(width)]
+
+    matrix, mask = ciphertext_matrix(ciphertexts)
+    return [matrix[mask[:, i], i].tobytes()
+            for i in range(matrix.shape[1])]
+
+
+def key_confidence(scores, best):
+    """
+    Turns the scores of all 256 keys into the probability of the best one,
+    treating scores as log-likelihoods (as language.UnigramModel's are)
+    with every key equally likely up front.
+    """
+    return 1 / sum([math.exp(score - best) for score in scores])
+
+
+def recover_keystream(ciphertexts, model=language.english, vectorize=True):
+    """
+    Breaks every keystream position out to the longest ciphertext, and
+    returns the keystream and a confidence between 0 and 1 for each byte.
+
+    With NumPy and a unigram model, the histograms of all columns are
+    counted at once and every key of every column is scored in a single
+    matrix product. Otherwise each column is ranked separately.
+    """
+    if not ciphertexts:
+        return b"", []
+
+    if numpy is not None and vectorize and \
+            isinstance(model, language.UnigramModel):
+        scores = model.key_scores(column_histograms(ciphertexts))
+        keystream = scores.argmax(axis=1)
+        best = scores.max(axis=1)
+        confidence = 1 / numpy.exp(scores - best[:, None]).sum(axis=1)
+
+        return bytes(keystream.astype(numpy.uint8)), confidence.tolist()
+
+    keystream = bytearray()
+    confidence = []
+
+    for column in transpose_ciphertexts(ciphertexts):
+        ranking = model.rank_keys(column, vectorize)
+        keystream.append(ranking[0][0])
+        confidence.append(key_confidence([s for _, s in ranking],
+                                         ranking[0][1]))
+
+    return bytes(keystream), confidence
+
+
+def attack_repeating_ctr_nonce(ciphertexts, model=language.english):
+    """
+    Treats the ciphertexts as repeating-key XOR with the keystream as key,
+    like challenge 6, and breaks each column with single-byte XOR. Returns
+    the keystream, as long as the longest ciphertext.
+    """
+    return recover_keystream(ciphertexts, model)[0]
+
+
+class Challenge20(unittest.TestCase):
+    def test_attack_repeating_ctr_nonce(self):
+        ciphertexts = generate_ciphertexts()
+        keystream, confidence = recover_keystream(ciphertexts)
+        plaintexts = [xor.xor(c, keystream[:len(c)]) for c in ciphertexts]
+
+        self.assertEqual(len(keystream), max(len(c) for c in ciphertexts))
+        self.assertEqual(len(confidence), len(keystream))
+        self.assertTrue(all(0 < c <= 1 for c in confidence))
+
+        # The first byte of each line comes out lowercase, but otherwise
+        # everything up to the last few positions, which only a couple of
+        # ciphertexts reach, is recovered with high confidence
+        self.assertEqual(plaintexts[1][1:],
+                         b"uz I came back to attack others in spite- / "
+                         b"Strike like lightnin', It's quite frightenin'!")
+        self.assertGreater(min(confidence[:90]), 0.95)
+        self.assertLess(min(confidence[-10:]), 0.5)
+
+    def test_vectorized(self):
+        ciphertexts = generate_ciphertexts()
+        keystream, confidence = recover_keystream(ciphertexts)
+        expected, expected_confidence = recover_keystream(ciphertexts,
+                                                          vectorize=False)
+
+        self.assertEqual(keystream, expected)
+
+        for c, expected_c in zip(confidence, expected_confidence):
+            self.assertAlmostEqual(c, expected_c)
+
+    @unittest.skipIf(numpy is None, "requires NumPy")
+    def test_ragged(self):
+        ciphertexts = [b"abc", b"", b"de"]
+        matrix, mask = ciphertext_matrix(ciphertexts)
+
+        self.assertEqual(matrix.tolist(), [[97, 98, 99], [0, 0, 0],
+                                           [100, 101, 0]])
+        self.assertEqual(mask.sum(axis=0).tolist(), [2, 2, 1])
+        self.assertEqual(transpose_ciphertexts(ciphertexts),
+                         [b"ad", b"be", b"c"])
 
 
 if __name__ == '__main__':
+    # Optionally score with a model file written by language.py
+    model = language.load(sys.argv[1]) if len(sys.argv) > 1 else \
+        language.english
     ciphertexts = generate_ciphertexts()
-    keystream = attack_repeating_ctr_nonce(ciphertexts)
+    keystream = attack_repeating_ctr_nonce(ciphertexts, model)
 
     for ciphertext in ciphertexts:
-        plaintext = challenge_05.repeating_xor(keystream, ciphertext)
+        plaintext = xor.xor(ciphertext, keystream[:len(ciphertext)])
         print(plaintext)
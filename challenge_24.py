@@ -6,6 +6,7 @@ import unittest
 import random
 import time
 import challenge_21
+import xor
 
 
 class MT19937StreamCipher():
@@ -17,21 +18,15 @@ class MT19937StreamCipher():
         Encrypts using a keystream derived from MT19937 seeded with a secret.
         """
         prng = challenge_21.MT19937(self.key)
-        keystream = b""
-        ciphertext = b""
         keystream_len = div_round_up(len(plaintext), 4)  # 4 bytes in a 32-bit
                                                          # word
 
         # First generate a keystream of the correct length
-        for _ in range(keystream_len):
-            num = prng.extract_number()
-            keystream += num.to_bytes(4, byteorder='big')
+        keystream = b"".join(prng.extract_number().to_bytes(4, byteorder='big')
+                             for _ in range(keystream_len))
 
         # Then XOR the plaintext with the generated keystream
-        for i, c in enumerate(plaintext):
-            ciphertext += bytes([c ^ keystream[i]])
-
-        return ciphertext
+        return xor.xor(plaintext, keystream[:len(plaintext)])
 
     def decrypt(self, ciphertext):
         return self.encrypt(ciphertext)
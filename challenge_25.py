@@ -6,6 +6,7 @@ import random
 import base64
 import challenge_11
 import challenge_18
+import xor
 
 
 def deterministic_random_key():
@@ -29,15 +30,14 @@ def get_ciphertext():
     return encrypt(get_plaintext())
 
 
-def edit(offset, newtext):
+def edit(ciphertext, offset, newtext):
     """
-    Performs an edit, which "seeks" into the ciphertext, decrypts it, and
-    re-encrypts it with a provided plaintext at a provided offset.
+    Performs an edit, which "seeks" into the ciphertext and re-encrypts it
+    with a provided plaintext at a provided offset. Only the keystream blocks
+    covering the edit are generated.
     """
-    plaintext = get_plaintext()
-    plaintext[offset:offset + len(newtext)] = newtext
-
-    return encrypt(plaintext)
+    cipher = challenge_18.AES_CTR(deterministic_random_key())
+    return cipher.edit(ciphertext, offset, newtext, b"\x00")
 
 
 def recover_plaintext(ciphertext, edit_func):
@@ -50,13 +50,9 @@ def recover_plaintext(ciphertext, edit_func):
     the keystream and leave only the plaintext.
     """
     new_plaintext = b"\x00" * len(ciphertext)
-    new_cipheretext = edit_func(0, new_plaintext)
-    plaintext = b""
-
-    for i, c in enumerate(new_cipheretext):
-        plaintext += bytes([c ^ ciphertext[i]])
+    new_cipheretext = edit_func(ciphertext, 0, new_plaintext)
 
-    return plaintext
+    return xor.xor(new_cipheretext, ciphertext)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+# GF(2^8) arithmetic
+#
+# Multiplication in the finite field used by AES, modulo the irreducible
+# polynomial m(x) = x⁸ + x⁴ + x³ + x + 1. Rather than reducing after every
+# shift like challenge_07.xtime, everything here is looked up in tables that
+# are computed once at import.
+
+import unittest
+
+# AES' irreducible polynomial, m(x)
+modulus = 0x11b
+
+# Antilog (exponent) and log tables for the generator 3. exp is doubled in
+# length so that exp[log[a] + log[b]] never needs to be reduced mod 255.
+exp = [0] * 510
+log = [0] * 256
+
+
+def init_log_tables():
+    """
+    Fills the log and antilog tables by walking through the powers of 3,
+    which generate every non-zero element of the field.
+    """
+    x = 1
+
+    for i in range(255):
+        exp[i] = exp[i + 255] = x
+        log[x] = i
+
+        # Multiply by 3, i.e. x ⊕ 2·x
+        doubled = x << 1
+        if doubled & 0x100:
+            doubled ^= modulus
+        x ^= doubled
+
+
+def gmul(a, b):
+    """
+    Multiplies a by b using the log and antilog tables, since
+    a·b = 3^(log₃(a) + log₃(b)).
+    """
+    if a == 0 or b == 0:
+        return 0
+
+    return exp[log[a] + log[b]]
+
+
+def mul_table(n):
+    """
+    Returns a 256-entry table of x·n for every byte x.
+    """
+    return [gmul(x, n) for x in range(256)]
+
+
+init_log_tables()
+
+# Tables for the constants used by MixColumns and InvMixColumns
+mul2 = mul_table(2)
+mul3 = mul_table(3)
+mul9 = mul_table(9)
+mul11 = mul_table(11)
+mul13 = mul_table(13)
+mul14 = mul_table(14)
+
+
+class GF256Test(unittest.TestCase):
+    def test_gmul(self):
+        # Shift-and-add multiplication, reducing after every shift
+        def slow_gmul(a, b):
+            product = 0
+            while b:
+                if b & 1:
+                    product ^= a
+                a <<= 1
+                if a & 0x100:
+                    a ^= modulus
+                b >>= 1
+            return product
+
+        for a in range(256):
+            for b in range(256):
+                self.assertEqual(gmul(a, b), slow_gmul(a, b))
+
+        # Example from Section 4.2 of FIPS-197
+        self.assertEqual(gmul(0x57, 0x83), 0xc1)
+
+    def test_tables(self):
+        for table, n in ((mul2, 2), (mul3, 3), (mul9, 9), (mul11, 11),
+                         (mul13, 13), (mul14, 14)):
+            self.assertEqual(table, [gmul(x, n) for x in range(256)])
+
+        self.assertEqual(mul2[0x57], 0xae)
+        self.assertEqual(mul2[0xae], 0x47)
+
+
+if __name__ == '__main__':
+    unittest.main()
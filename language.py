@@ -0,0 +1,478 @@
+# Language models
+#
+# Models of English text used to score candidate plaintexts. Each model is
+# compiled into a flat lookup table indexed by byte (256 entries) or by pair
+# of adjacent bytes (65536 entries), so scoring never goes through chr() or
+# a dict. Models can be trained from any text corpus and saved to a small
+# binary file, which is memory-mapped when loaded:
+#
+#   python language.py train bigram english.bin corpus1.txt corpus2.txt
+#
+# Every model has score(data), where higher is more English-like, and
+# rank_keys(ciphertext), which scores all 256 single-byte XOR keys at once,
+# using NumPy if it is installed unless vectorize is False.
+
+import abc
+import argparse
+import array
+import collections
+import math
+import mmap
+import os
+import sys
+import tempfile
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Approximate frequencies (in %) of lowercase letters in English text
+letter_frequencies = {
+    "a": 8.167, "b": 1.492, "c": 2.782, "d": 4.253, "e": 12.702,
+    "f": 2.228, "g": 2.015, "h": 6.094, "i": 6.966, "j": 0.153, "k": 0.772,
+    "l": 4.025, "m": 2.406, "n": 6.749, "o": 7.507, "p": 1.929, "q": 0.095,
+    "r": 5.987, "s": 6.327, "t": 9.056, "u": 2.758, "v": 0.978, "w": 2.360,
+    "x": 0.150, "y": 1.974, "z": 0.074
+}
+
+# Share of each kind of character in running text. Whatever isn't listed
+# gets a small floor so that no byte is impossible.
+lowercase_share = 0.78
+uppercase_share = 0.03
+space_share = 0.16
+punctuation_share = {
+    ",": 0.0070, ".": 0.0065, "'": 0.0030, "\"": 0.0020, "\n": 0.0030,
+    "-": 0.0015, "?": 0.0007, "!": 0.0005, ";": 0.0003, ":": 0.0003,
+    "(": 0.0002, ")": 0.0002
+}
+digit_share = 0.0005
+floor_share = 1e-6
+
+# File format: magic, format version, model kind, byte order, padding, then
+# the table as doubles
+magic = b"LMDL"
+version = 1
+header_size = 8
+byte_orders = {b"<": "little", b">": "big"}
+
+
+def english_probabilities():
+    """
+    Returns the probability of each byte value in English text, based on
+    letter_frequencies and the character shares above.
+    """
+    shares = [floor_share] * 256
+
+    for letter, frequency in letter_frequencies.items():
+        shares[ord(letter)] += lowercase_share * frequency / 100
+        shares[ord(letter.upper())] += uppercase_share * frequency / 100
+
+    shares[ord(" ")] += space_share
+
+    for char, share in punctuation_share.items():
+        shares[ord(char)] += share
+
+    for digit in b"0123456789":
+        shares[digit] += digit_share
+
+    total = sum(shares)
+    return [share / total for share in shares]
+
+
+def byte_histogram(data):
+    """
+    Returns a list of how many times each byte value occurs in data.
+    """
+    if numpy is not None and isinstance(data, (bytes, bytearray,
+                                               memoryview)):
+        view = numpy.asarray(memoryview(data))
+        return numpy.bincount(view, minlength=256).tolist()
+
+    counts = [0] * 256
+
+    for b, count in collections.Counter(data).items():
+        counts[b] = count
+
+    return counts
+
+
+def pair_histogram(data):
+    """
+    Returns a dict of how many times each pair of adjacent bytes occurs in
+    data, keyed by first_byte << 8 | second_byte.
+    """
+    data = bytes(data)
+    return collections.Counter(
+        int.from_bytes(data[i:i + 2], 'big') for i in range(len(data) - 1))
+
+
+def key_score_matrix(table):
+    """
+    Returns the 256×256 NumPy matrix whose row k holds table[b ^ k] for every
+    byte b.
+    """
+    indices = numpy.arange(256)
+    return numpy.asarray(table, dtype=float)[indices[:, None] ^ indices]
+
+
+def ranked(scores):
+    """
+    Turns a list of 256 key scores into (key, score) pairs, best first. Ties
+    go to the lowest key.
+    """
+    return sorted(enumerate(scores), key=lambda x: -x[1])
+
+
+class Model(abc.ABC):
+    """
+    Base class for models backed by a table of doubles. Subclasses set kind
+    and size, and implement score() and rank_keys().
+    """
+
+    kind = None
+    size = 0
+
+    # Plaintexts scoring at or below this are not considered English
+    threshold = 1.0
+
+    def __init__(self, table):
+        if len(table) != self.size:
+            raise ValueError("Invalid table size")
+
+        if not isinstance(table, (array.array, memoryview)):
+            table = array.array("d", table)
+
+        self.table = table
+
+    def save(self, path):
+        """
+        Writes the model to a binary file that can be read with load().
+        """
+        order = b"<" if sys.byteorder == "little" else b">"
+        header = magic + bytes([version, model_kinds.index(type(self))]) + \
+            order + b"\x00"
+
+        with open(path, "wb") as f:
+            f.write(header)
+            f.write(array.array("d", self.table).tobytes())
+
+    @abc.abstractmethod
+    def score(self, data):
+        """
+        Returns how much data looks like English, higher is better.
+        """
+
+    @abc.abstractmethod
+    def rank_keys(self, ciphertext, vectorize=True):
+        """
+        Returns every single-byte XOR key for ciphertext as (key, score),
+        best first.
+        """
+
+
+class UnigramModel(Model):
+    """
+    Scores text by the sum of a score per byte. Trained models use the log
+    of how much more likely each byte is in English than in uniformly random
+    bytes, so the score of some text is its log-likelihood ratio and is
+    positive when it looks more like English than noise.
+    """
+
+    kind = "unigram"
+    size = 256
+
+    def __init__(self, table):
+        super().__init__(table)
+        self.matrix = None
+
+    @classmethod
+    def from_probabilities(cls, probabilities):
+        return cls([math.log(256 * p) for p in probabilities])
+
+    @classmethod
+    def train(cls, text, smoothing=0.5):
+        counts = byte_histogram(text)
+        total = len(text) + 256 * smoothing
+
+        return cls.from_probabilities([(c + smoothing) / total
+                                       for c in counts])
+
+    def score(self, data):
+        table = self.table
+        return sum([table[b] for b in data])
+
+    def rank_keys(self, ciphertext, vectorize=True):
+        """
+        Key k turns each ciphertext byte b into b ^ k, so its score is
+        Σ count[b]·table[b ^ k] over the ciphertext histogram. After counting
+        the bytes once, the cost doesn't depend on the length of the
+        ciphertext. With NumPy, all 256 scores are a single matrix-vector
+        product.
+        """
+        counts = byte_histogram(ciphertext)
+
+        if numpy is not None and vectorize:
+            return ranked(self.key_scores(numpy.asarray(counts)).tolist())
+
+        table = self.table
+        present = [(b, count) for b, count in enumerate(counts) if count]
+
+        return ranked([sum([count * table[b ^ k] for b, count in present])
+                       for k in range(256)])
+
+    def key_scores(self, histograms):
+        """
+        Returns the score of every key for one histogram or for each row of a
+        2D array of histograms, as a NumPy array of the same shape.
+        """
+        if self.matrix is None:
+            self.matrix = key_score_matrix(self.table)
+
+        return histograms @ self.matrix.T
+
+
+class ChiSquaredModel(Model):
+    """
+    Scores text by minus the chi-squared statistic of its byte counts
+    against the expected English probabilities, so 0 is a perfect match.
+    """
+
+    kind = "chi-squared"
+    size = 256
+    threshold = -math.inf
+
+    def __init__(self, table):
+        super().__init__(table)
+        self.matrix = None
+
+    @classmethod
+    def train(cls, text, smoothing=0.5):
+        counts = byte_histogram(text)
+        total = len(text) + 256 * smoothing
+
+        return cls([(c + smoothing) / total for c in counts])
+
+    def score(self, data):
+        counts = byte_histogram(data)
+        n = len(data)
+
+        if n == 0:
+            return 0.0
+
+        return -sum([(count - n * p) ** 2 / (n * p)
+                     for count, p in zip(counts, self.table)])
+
+    def rank_keys(self, ciphertext, vectorize=True):
+        """
+        With count[b] occurrences of b among n bytes, chi-squared for key k
+        expands to Σ count[b]² / (n·p[b ^ k]) - n, which is again a product
+        of a fixed matrix with a vector, the squared counts.
+        """
+        counts = byte_histogram(ciphertext)
+        n = len(ciphertext)
+
+        if n == 0:
+            return ranked([0.0] * 256)
+
+        if numpy is not None and vectorize:
+            if self.matrix is None:
+                self.matrix = key_score_matrix([1 / p for p in self.table])
+            squares = numpy.asarray(counts, dtype=float) ** 2
+            return ranked((n - self.matrix @ squares / n).tolist())
+
+        table = self.table
+        present = [(b, count * count) for b, count in enumerate(counts)
+                   if count]
+
+        return ranked([n - sum([square / table[b ^ k]
+                                for b, square in present]) / n
+                       for k in range(256)])
+
+
+class BigramModel(Model):
+    """
+    Scores text by the sum of a score per pair of adjacent bytes, indexed by
+    first_byte << 8 | second_byte. Trained models use the log-likelihood
+    ratio against random bytes, like UnigramModel. Text shorter than two
+    bytes scores 0.
+    """
+
+    kind = "bigram"
+    size = 65536
+
+    @classmethod
+    def train(cls, text, smoothing=0.01):
+        counts = pair_histogram(text)
+        total = max(len(text) - 1, 0) + 65536 * smoothing
+
+        return cls([math.log(65536 * (counts.get(pair, 0) + smoothing)
+                             / total) for pair in range(65536)])
+
+    def score(self, data):
+        table = self.table
+        data = bytes(data)
+
+        return sum([table[int.from_bytes(data[i:i + 2], 'big')]
+                    for i in range(len(data) - 1)])
+
+    def rank_keys(self, ciphertext, vectorize=True):
+        """
+        XORing both bytes of a pair with k XORs its index with k·0x101, so
+        every key is scored from one histogram of the ciphertext's pairs.
+        """
+        counts = pair_histogram(ciphertext)
+
+        if not counts:
+            return ranked([0.0] * 256)
+
+        if numpy is not None and vectorize:
+            table = numpy.asarray(self.table, dtype=float)
+            pairs = numpy.fromiter(counts.keys(), dtype=numpy.int64)
+            weights = numpy.fromiter(counts.values(), dtype=float)
+            return ranked([float(table[pairs ^ (k * 0x101)] @ weights)
+                           for k in range(256)])
+
+        table = self.table
+        return ranked([sum([count * table[pair ^ (k * 0x101)]
+                            for pair, count in counts.items()])
+                       for k in range(256)])
+
+
+model_kinds = [UnigramModel, ChiSquaredModel, BigramModel]
+
+
+def load(path):
+    """
+    Loads a model written by Model.save(). The table is memory-mapped rather
+    than read, unless it was saved on a machine with the other byte order.
+    """
+    with open(path, "rb") as f:
+        # Too short for a header (empty files can't be mapped either)
+        if os.fstat(f.fileno()).st_size < header_size:
+            raise ValueError("Invalid model file")
+
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    header = data[:header_size]
+    valid = header[:4] == magic and header[4] == version and \
+        header[5] < len(model_kinds) and header[6:7] in byte_orders
+
+    if valid:
+        cls = model_kinds[header[5]]
+        valid = len(data) - header_size == 8 * cls.size
+
+    if not valid:
+        data.close()
+        raise ValueError("Invalid model file")
+
+    if byte_orders[header[6:7]] == sys.byteorder:
+        table = memoryview(data)[header_size:].cast("d")
+    else:
+        table = array.array("d", data[header_size:])
+        table.byteswap()
+        data.close()
+
+    return cls(table)
+
+
+def train(kind, text):
+    """
+    Trains a model of the given kind ("unigram", "chi-squared" or "bigram")
+    on a corpus of text.
+    """
+    for cls in model_kinds:
+        if cls.kind == kind:
+            return cls.train(text)
+
+    raise ValueError("Invalid model kind")
+
+
+# Default models, built from the frequency table above
+english = UnigramModel.from_probabilities(english_probabilities())
+english_chi_squared = ChiSquaredModel(english_probabilities())
+
+
+class LanguageTest(unittest.TestCase):
+    corpus = (b"It was the best of times, it was the worst of times, it was "
+              b"the age of wisdom, it was the age of foolishness, it was the "
+              b"epoch of belief, it was the epoch of incredulity, it was the "
+              b"season of Light, it was the season of Darkness.\n") * 4
+
+    def models(self):
+        return [english, english_chi_squared] + \
+            [train(cls.kind, self.corpus) for cls in model_kinds]
+
+    def test_score(self):
+        english_text = b"the quick brown fox jumps over the lazy dog"
+        noise = bytes(range(0, 256, 6))
+
+        for model in self.models():
+            self.assertGreater(model.score(english_text), model.score(noise))
+
+        self.assertGreater(english.score(english_text), english.threshold)
+        self.assertLess(english.score(noise), english.threshold)
+
+    def test_rank_keys(self):
+        plaintext = b"it was the age of wisdom and the season of light"
+        ciphertext = bytes(c ^ 0x5a for c in plaintext)
+
+        for model in self.models():
+            scores = [model.score(bytes(c ^ k for c in ciphertext))
+                      for k in range(256)]
+
+            for vectorize in (True, False):
+                ranking = model.rank_keys(ciphertext, vectorize)
+                self.assertEqual(ranking[0][0], 0x5a)
+                self.assertEqual(len(ranking), 256)
+
+                for key, score in ranking:
+                    self.assertAlmostEqual(score, scores[key], delta=1e-9 *
+                                           max(1, abs(scores[key])))
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "model.bin")
+
+            for model in self.models():
+                model.save(path)
+                loaded = load(path)
+
+                self.assertIs(type(loaded), type(model))
+                self.assertEqual(list(loaded.table), list(model.table))
+                self.assertEqual(loaded.score(self.corpus),
+                                 model.score(self.corpus))
+                del loaded
+
+            english.save(path)
+
+            with open(path, "rb") as f:
+                saved = f.read()
+
+            # Not a model, truncated in the header, and a table of the
+            # wrong size for the kind of model
+            for data in (b"not a model", saved[:6], saved[:-8],
+                         saved + bytes(3)):
+                with open(path, "wb") as f:
+                    f.write(data)
+
+                with self.assertRaises(ValueError):
+                    load(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Train a language model from text files.")
+    parser.add_argument("command", choices=("train",))
+    parser.add_argument("kind", choices=[cls.kind for cls in model_kinds])
+    parser.add_argument("output")
+    parser.add_argument("corpus", nargs="+")
+    args = parser.parse_args()
+
+    text = b""
+    for path in args.corpus:
+        with open(path, "rb") as f:
+            text += f.read() + b"\n"
+
+    train(args.kind, text).save(args.output)
@@ -0,0 +1,120 @@
+# XOR
+#
+# Whole-buffer XOR shared by the challenges. Small buffers are XORed as a
+# single big integer, which is much faster than going byte by byte in Python.
+# If NumPy is installed, larger buffers are XORed as uint8 arrays instead.
+
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Buffer length from which NumPy is used. Below this the cost of wrapping
+# the buffers in arrays outweighs the faster XOR.
+min_vector_size = 1024
+
+
+def as_array(buffer):
+    """
+    Returns a uint8 NumPy view of a bytes-like object, which may be a strided
+    memoryview. Other sequences of byte values, such as lists of ints, are
+    copied into bytes first.
+    """
+    try:
+        view = memoryview(buffer)
+    except TypeError:
+        view = memoryview(bytes(buffer))
+
+    return numpy.asarray(view)
+
+
+def xor(a, b):
+    """
+    Returns a ⊕ b for two bytes-like objects of the same length.
+    """
+    n = len(a)
+
+    if len(b) != n:
+        raise ValueError("Buffers must be of equal length")
+
+    if numpy is not None and n >= min_vector_size:
+        return numpy.bitwise_xor(as_array(a), as_array(b)).tobytes()
+
+    x = int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')
+    return x.to_bytes(n, 'little')
+
+
+def xor_into(buffer, src, offset=0):
+    """
+    XORs src into a writable buffer (such as a bytearray, an mmap or a
+    memoryview of shared memory) in place, starting at offset.
+    """
+    end = offset + len(src)
+
+    if end > len(buffer):
+        raise ValueError("Buffer too small")
+
+    if numpy is not None and len(src) >= min_vector_size:
+        view = numpy.frombuffer(buffer, numpy.uint8)[offset:end]
+        numpy.bitwise_xor(view, as_array(src), out=view)
+    else:
+        buffer[offset:end] = xor(buffer[offset:end], src)
+
+
+def xor_repeating(key, data, offset=0):
+    """
+    Returns data XORed with key repeated over its whole length. offset is the
+    position of data in a longer stream, so the key starts at byte
+    offset % len(key) rather than at the beginning.
+    """
+    if not key:
+        raise ValueError("Key must not be empty")
+
+    phase = offset % len(key)
+    repeats = (phase + len(data)) // len(key) + 1
+    return xor(data, (bytes(key) * repeats)[phase:phase + len(data)])
+
+
+class XORTest(unittest.TestCase):
+    def test_xor(self):
+        a = bytes(range(256)) * 20
+        b = bytes(range(255, -1, -1)) * 20
+        strided = memoryview(bytes(x for c in a for x in (c, 0)))[::2]
+
+        for n in (0, 1, 16, min_vector_size - 1, min_vector_size, len(a)):
+            expected = bytes(x ^ y for x, y in zip(a[:n], b[:n]))
+            self.assertEqual(xor(a[:n], b[:n]), expected)
+            self.assertEqual(xor(memoryview(a)[:n], bytearray(b[:n])),
+                             expected)
+            self.assertEqual(xor(strided[:n], b[:n]), expected)
+            self.assertEqual(xor(list(a[:n]), b[:n]), expected)
+
+        with self.assertRaises(ValueError):
+            xor(b"ab", b"a")
+
+    def test_xor_into(self):
+        src = bytes(range(256)) * 8
+
+        for n in (3, len(src)):
+            buffer = bytearray(b"\x01" * (n + 10))
+            xor_into(buffer, src[:n], 5)
+            self.assertEqual(buffer, b"\x01" * 5 + xor(src[:n], b"\x01" * n)
+                             + b"\x01" * 5)
+
+        with self.assertRaises(ValueError):
+            xor_into(bytearray(4), b"abc", 2)
+
+    def test_xor_repeating(self):
+        key = b"ICE"
+        data = bytes(range(100))
+        expected = bytes(c ^ key[i % 3] for i, c in enumerate(data))
+
+        self.assertEqual(xor_repeating(key, data), expected)
+        self.assertEqual(xor_repeating(key, b""), b"")
+        self.assertEqual(xor_repeating(key, data[7:], 7), expected[7:])
+
+
+if __name__ == '__main__':
+    unittest.main()